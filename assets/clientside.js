@@ -0,0 +1,148 @@
+// Callback lato client della dashboard completa.
+// Solo trasformazioni di vista (unità, fonti, assoluto/percentuale, pro capite)
+// sui dati già presenti nei dcc.Store: nessuna richiesta al server.
+(function() {
+    var UNITS = {MWh: 1, GWh: 1e-3, TWh: 1e-6};
+
+    function factor(unit, perCapita, population, country) {
+        var f = UNITS[unit] || 1;
+        if (perCapita && perCapita.length && population && population[country]) {
+            f = f / population[country];
+        }
+        return f;
+    }
+
+    function unitLabel(unit, perCapita) {
+        return perCapita && perCapita.length ? unit + ' per capita' : unit;
+    }
+
+    function scaled(values, f) {
+        return values.map(function(v) { return v === null ? null : v * f; });
+    }
+
+    function emptyFigure(title) {
+        return {data: [], layout: {title: {text: title}}};
+    }
+
+    // Un sottografico per paese, affiancati come facet_col di plotly express
+    function facetLayout(countries, layout) {
+        var n = countries.length, gap = 0.03;
+        var width = (1 - gap * (n - 1)) / n;
+        layout.annotations = [];
+        countries.forEach(function(country, i) {
+            var suffix = i === 0 ? '' : String(i + 1);
+            var left = i * (width + gap);
+            layout['xaxis' + suffix] = {domain: [left, left + width], anchor: 'y' + suffix};
+            layout['yaxis' + suffix] = {anchor: 'x' + suffix};
+            if (i > 0) {
+                layout['yaxis' + suffix].matches = 'y';
+                layout['yaxis' + suffix].showticklabels = false;
+            }
+            layout.annotations.push({
+                text: 'country_code=' + country, showarrow: false,
+                xref: 'paper', yref: 'paper', x: left + width / 2, y: 1.0,
+                xanchor: 'center', yanchor: 'bottom'
+            });
+        });
+        return layout;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        energy: {
+            timeSeries: function(data, unit, perCapita, population) {
+                var countries = Object.keys(data || {});
+                if (!countries.length) {
+                    return emptyFigure('No data for time series');
+                }
+                var traces = [];
+                countries.forEach(function(country) {
+                    var f = factor(unit, perCapita, population, country);
+                    var series = data[country];
+                    traces.push({type: 'scatter', mode: 'lines', name: country + ' consumption',
+                                 x: series.x, y: scaled(series.cons, f)});
+                    traces.push({type: 'scatter', mode: 'lines', name: country + ' production',
+                                 x: series.x, y: scaled(series.prod, f)});
+                });
+                return {data: traces, layout: {
+                    title: {text: 'Time series: consumption vs. production'},
+                    xaxis: {title: {text: 'Data'}},
+                    yaxis: {title: {text: unitLabel(unit, perCapita)}}
+                }};
+            },
+
+            productionMix: function(data, unit, mode, sources, perCapita, population) {
+                var countries = Object.keys(data || {});
+                if (!countries.length) {
+                    return emptyFigure('No production data');
+                }
+                var visible = {};
+                (sources || []).forEach(function(s) { visible[s] = true; });
+                var percent = mode === 'percent';
+                var traces = [];
+                countries.forEach(function(country, i) {
+                    var suffix = i === 0 ? '' : String(i + 1);
+                    var f = factor(unit, perCapita, population, country);
+                    var series = data[country].series;
+                    var first = true;
+                    Object.keys(series).forEach(function(source) {
+                        if (!visible[source]) {
+                            return;
+                        }
+                        var trace = {
+                            type: 'scatter', mode: 'lines', name: source, legendgroup: source,
+                            showlegend: i === 0, stackgroup: country,
+                            x: data[country].x, y: scaled(series[source], f),
+                            xaxis: 'x' + suffix, yaxis: 'y' + suffix
+                        };
+                        // groupnorm si imposta sulla prima traccia del gruppo
+                        if (first && percent) {
+                            trace.groupnorm = 'percent';
+                        }
+                        first = false;
+                        traces.push(trace);
+                    });
+                });
+                var layout = facetLayout(countries, {title: {text: 'Stacked area: production mix'}});
+                layout.yaxis.title = {text: percent ? '%' : unitLabel(unit, perCapita)};
+                return {data: traces, layout: layout};
+            },
+
+            netBalance: function(data, unit, perCapita, population) {
+                if (!data || !data.country || !data.country.length) {
+                    return emptyFigure('No flow data');
+                }
+                var fs = data.country.map(function(c) { return factor(unit, perCapita, population, c); });
+                var traces = ['export', 'import', 'net_balance'].map(function(variable) {
+                    return {type: 'bar', name: variable, x: data.country,
+                            y: data[variable].map(function(v, i) { return v === null ? null : v * fs[i]; })};
+                });
+                return {data: traces, layout: {
+                    title: {text: 'Bar chart: net flows by country'}, barmode: 'group',
+                    xaxis: {title: {text: 'country'}},
+                    yaxis: {title: {text: unitLabel(unit, perCapita)}}
+                }};
+            },
+
+            heatmap: function(data, unit, perCapita, population) {
+                var countries = Object.keys(data || {});
+                if (!countries.length) {
+                    return emptyFigure('No consumption data');
+                }
+                var traces = countries.map(function(country, i) {
+                    var suffix = i === 0 ? '' : String(i + 1);
+                    var f = factor(unit, perCapita, population, country);
+                    return {
+                        type: 'heatmap', name: country, x: data[country].hours, y: data[country].days,
+                        z: data[country].z.map(function(row) { return scaled(row, f); }),
+                        coloraxis: 'coloraxis', xaxis: 'x' + suffix, yaxis: 'y' + suffix
+                    };
+                });
+                var layout = facetLayout(countries, {title: {text: 'Heatmap: hourly consumption patterns'}});
+                layout.coloraxis = {colorbar: {title: {text: unitLabel(unit, perCapita)}}};
+                layout.xaxis.title = {text: 'Ora'};
+                layout.yaxis.title = {text: 'Giorno'};
+                return {data: traces, layout: layout};
+            }
+        }
+    });
+})();
@@ -0,0 +1,220 @@
+import argparse
+import glob
+import logging
+import os
+import re
+
+import pandas as pd
+
+import ingestion_entsoe as ingestion
+from connect_local import get_connection
+from dirty_ranges import ensure_dirty_ranges_table
+from gap_index import refresh_gap_index
+from hourly_grid import ensure_hourly_tables
+from stats_energy import update_kpis
+from replica_energy import refresh_replica
+from snapshot_energy import build_snapshot
+
+# ------------------------------
+# Backfill da file ENTSO-E (File Library / SFTP)
+# ------------------------------
+# File CSV (separati da tab) o Parquet letti a blocchi, senza rete.
+# Ogni blocco viene scritto con gli stessi insert_* dell'ingestion API, in una
+# transazione per blocco e un savepoint per serie.
+CHUNK_ROWS = int(os.getenv("BACKFILL_CHUNK_ROWS", 200000))
+
+# Colonne usate per dataset (nomi senza suffissi come "(UTC)" o "[MW]")
+DATASETS = {
+    "generation": {
+        "marker": "ProductionType",
+        "value": "ActualGenerationOutput",
+        "columns": ["DateTime", "ResolutionCode", "AreaTypeCode", "MapCode", "ProductionType", "ActualGenerationOutput"],
+    },
+    "load": {
+        "marker": "TotalLoadValue",
+        "value": "TotalLoadValue",
+        "columns": ["DateTime", "ResolutionCode", "AreaTypeCode", "MapCode", "TotalLoadValue"],
+    },
+    "flows": {
+        "marker": "FlowValue",
+        "value": "FlowValue",
+        "columns": ["DateTime", "ResolutionCode", "OutAreaTypeCode", "OutMapCode",
+                    "InAreaTypeCode", "InMapCode", "FlowValue"],
+    },
+}
+# Nelle esportazioni più recenti alcune colonne hanno cambiato nome
+ALIASES = {
+    "TotalLoad": "TotalLoadValue",
+    "ActualGenerationOutputMW": "ActualGenerationOutput",
+    "AreaMapCode": "MapCode",
+    "OutAreaMapCode": "OutMapCode",
+    "InAreaMapCode": "InMapCode",
+}
+
+def canonical_name(column):
+    name = re.sub(r"\s*[\(\[].*?[\)\]]", "", str(column)).strip()
+    return ALIASES.get(name, name)
+
+# ------------------------------
+# Lettura a blocchi
+# ------------------------------
+def read_header(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    return pd.read_csv(path, sep="\t", nrows=0, encoding="utf-8-sig").columns.tolist()
+
+def resolution_minutes(code):
+    # ResolutionCode ISO 8601 (PT15M, PT30M, PT60M/PT1H); None se assente o non in minuti/ore
+    match = re.fullmatch(r"PT(\d+)([MH])", str(code).strip())
+    if not match:
+        return None
+    return int(match.group(1)) * (60 if match.group(2) == "H" else 1)
+
+def detect_dataset(header):
+    names = {canonical_name(c) for c in header}
+    for dataset, spec in DATASETS.items():
+        if spec["marker"] in names:
+            return dataset
+    return None
+
+def iter_file_chunks(path, header, dataset):
+    # Solo le colonne necessarie, rinominate con i nomi canonici
+    wanted = set(DATASETS[dataset]["columns"])
+    usecols = [c for c in header if canonical_name(c) in wanted]
+    rename = {c: canonical_name(c) for c in usecols}
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        # Un row group alla volta: la memoria resta limitata anche su file di anni
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK_ROWS, columns=usecols):
+            yield batch.to_pandas().rename(columns=rename)
+    else:
+        reader = pd.read_csv(
+            path, sep="\t", usecols=usecols, chunksize=CHUNK_ROWS, encoding="utf-8-sig",
+            memory_map=path.endswith(".csv"), dtype={c: "string" for c in usecols if "Code" in canonical_name(c)}
+        )
+        for chunk in reader:
+            yield chunk.rename(columns=rename)
+
+# ------------------------------
+# Mappatura sullo schema
+# ------------------------------
+def prepare_chunk(df, dataset, countries):
+    # Solo aree di tipo paese (CTY): le bidding zone e le control area duplicherebbero i valori
+    if dataset == "flows":
+        df = df[(df["OutAreaTypeCode"] == "CTY") & (df["InAreaTypeCode"] == "CTY")
+                & df["OutMapCode"].isin(countries) & df["InMapCode"].isin(countries)].copy()
+    else:
+        df = df[(df["AreaTypeCode"] == "CTY") & df["MapCode"].isin(countries)].copy()
+    value_col = DATASETS[dataset]["value"]
+    df[value_col] = pd.to_numeric(df[value_col], errors="coerce")
+    df = df.dropna(subset=[value_col])
+    df["timestamp"] = pd.to_datetime(df["DateTime"], utc=True)
+    return df
+
+def write_chunk(conn, df, dataset, total):
+    # La risoluzione dichiarata nel file (ResolutionCode) decide la durata dei punti nella
+    # griglia oraria; 0 = non dichiarata, dedotta dal passo tra i punti
+    df = df.assign(resolution=df["ResolutionCode"].map(resolution_minutes).fillna(0).astype(int))
+    if dataset == "generation":
+        for (country, resolution), country_df in df.groupby(["MapCode", "resolution"]):
+            # Stessa forma del DataFrame di query_generation: una colonna per fonte
+            wide = country_df.pivot_table(index="timestamp", columns="ProductionType",
+                                          values="ActualGenerationOutput", aggfunc="last")
+            ingestion.populate_energy_sources(conn, wide)
+            # Una fonte alla volta, senza i timestamp in cui quella fonte manca
+            for source in wide.columns:
+                ingestion.insert_production(conn, country, wide[[source]].dropna(), total,
+                                            resolution_minutes=int(resolution) or None)
+    elif dataset == "load":
+        for (country, resolution), country_df in df.groupby(["MapCode", "resolution"]):
+            series = country_df.groupby("timestamp")["TotalLoadValue"].last()
+            ingestion.insert_consumption(conn, country, series, total, resolution_minutes=int(resolution) or None)
+    else:
+        for (from_c, to_c, resolution), pair_df in df.groupby(["OutMapCode", "InMapCode", "resolution"]):
+            series = pair_df.groupby("timestamp")["FlowValue"].last()
+            ingestion.insert_flows(conn, from_c, to_c, series, total, resolution_minutes=int(resolution) or None)
+
+def backfill_file(conn, path, countries):
+    header = read_header(path)
+    dataset = detect_dataset(header)
+    if dataset is None:
+        logging.error(f"File {path}: formato non riconosciuto, saltato")
+        return None, None, None
+    missing = set(DATASETS[dataset]["columns"]) - {canonical_name(c) for c in header}
+    if missing:
+        logging.error(f"File {path} ({dataset}): colonne mancanti {sorted(missing)}, saltato")
+        return None, None, None
+
+    total = ingestion.new_write_stats()
+    first_ts = last_ts = None
+    for i, chunk in enumerate(iter_file_chunks(path, header, dataset)):
+        try:
+            df = prepare_chunk(chunk, dataset, countries)
+            if df.empty:
+                continue
+            with ingestion.chunk_transaction(conn, f"{os.path.basename(path)} blocco {i}"):
+                write_chunk(conn, df, dataset, total)
+        except Exception as e:
+            logging.error(f"Errore blocco {i} di {path}: {e}")
+            total["failed_chunks"] += 1
+            continue
+        first_ts = df["timestamp"].min() if first_ts is None else min(first_ts, df["timestamp"].min())
+        last_ts = df["timestamp"].max() if last_ts is None else max(last_ts, df["timestamp"].max())
+
+    logging.info(f"File {path} ({dataset}): {total}")
+    return dataset, first_ts, last_ts
+
+def expand_paths(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in ("*.csv", "*.csv.gz", "*.parquet"):
+                files.extend(glob.glob(os.path.join(path, "**", pattern), recursive=True))
+        else:
+            files.append(path)
+    return sorted(files)
+
+# ------------------------------
+# Main
+# ------------------------------
+def main(paths, countries):
+    logging.info(f"Inizio backfill da file")
+    conn = get_connection()
+    if not conn:
+        logging.error(f"Impossibile connettersi al DB.")
+        return
+
+    ingestion.populate_countries(conn)
+    ensure_dirty_ranges_table(conn)
+    ensure_hourly_tables(conn)
+
+    first_ts = last_ts = None
+    for path in expand_paths(paths):
+        dataset, file_first, file_last = backfill_file(conn, path, countries)
+        if file_first is not None:
+            first_ts = file_first if first_ts is None else min(first_ts, file_first)
+            last_ts = file_last if last_ts is None else max(last_ts, file_last)
+
+    # Stessi passi a valle dell'import API, limitati al periodo caricato
+    if first_ts is not None:
+        refresh_gap_index(conn, start=first_ts, end=last_ts)
+    update_kpis(conn)
+    refresh_replica(conn)
+    build_snapshot(conn)
+
+    conn.close()
+    logging.info(f"Backfill completato!")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill da file ENTSO-E (CSV/Parquet)")
+    parser.add_argument("paths", nargs="+", help="file o cartelle con i file esportati")
+    parser.add_argument("--countries", default=",".join(ingestion.countries),
+                        help="MapCode dei paesi da caricare, separati da virgola (default: FR,DE)")
+    parser.add_argument("--write-mode", choices=["insert", "upsert"], default=ingestion.WRITE_MODE,
+                        help="insert: ignora le revisioni; upsert: aggiorna solo i valori cambiati")
+    args = parser.parse_args()
+    ingestion.WRITE_MODE = args.write_mode
+    ingestion.setup_logging(prefix="backfill")
+    main(args.paths, [c.strip() for c in args.countries.split(",") if c.strip()])
@@ -1,5 +1,6 @@
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
@@ -21,3 +22,21 @@ def get_connection():
     except Exception as e:
         print("Errore nella connessione al DB:", e)
         return None
+
+def get_pool(minconn=1, maxconn=4):
+    # Pool thread-safe per processi long-running (es. ingestion_daemon.py)
+    try:
+        pool = ThreadedConnectionPool(
+            minconn,
+            maxconn,
+            host=DB_HOST,
+            port=DB_PORT,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASS
+        )
+        print("Pool di connessioni al DB creato!")
+        return pool
+    except Exception as e:
+        print("Errore nella creazione del pool DB:", e)
+        return None
@@ -4,7 +4,9 @@ import dash
 from dash import html, dcc, dash_table
 import plotly.express as px
 from sqlalchemy import create_engine
+from replica_energy import READ_BACKEND, read_df as read_replica_df
 from connect_local import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from tables_energy import load_energy
 
 # ------------------------------
 # Connessione al DB
@@ -12,6 +14,13 @@ from connect_local import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
 engine = create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
 def fetch_df(query):
+    # Con READ_BACKEND=duckdb le letture vanno sulla replica Parquet locale;
+    # se la replica non ha la tabella (o non è disponibile) si torna a PostgreSQL
+    if READ_BACKEND == "duckdb":
+        try:
+            return read_replica_df(query)
+        except Exception as e:
+            print("Replica non disponibile, lettura da PostgreSQL:", e)
     try:
         return pd.read_sql(query, engine)
     except Exception as e:
@@ -21,13 +30,14 @@ def fetch_df(query):
 # ------------------------------
 # Caricamento dati
 # ------------------------------
-consumption = fetch_df("SELECT country_code, timestamp, consumption_mwh FROM consumption;")
-production = fetch_df("""
+# Griglia oraria: le somme sono MWh reali anche per le serie a 15 minuti
+consumption = load_energy(fetch_df, "SELECT country_code, timestamp, consumption_mwh FROM consumption{suffix};")
+production = load_energy(fetch_df, """
 SELECT p.country_code, e.source_name, p.timestamp, p.production_mwh
-FROM production p
+FROM production{suffix} p
 JOIN energy_sources e ON p.source_id = e.source_id;
 """)
-flows = fetch_df("SELECT from_country, to_country, timestamp, flow_mwh FROM crossborder_flows;")
+flows = load_energy(fetch_df, "SELECT from_country, to_country, timestamp, flow_mwh FROM crossborder_flows{suffix};")
 
 # ------------------------------
 # Preprocessing
@@ -1,10 +1,14 @@
 # dashboard_energy_full.py
 import pandas as pd
 import dash
-from dash import html, dcc, dash_table
-import plotly.express as px
+from dash import html, dcc, dash_table, Input, Output, State, ClientsideFunction
 from sqlalchemy import create_engine
+from replica_energy import READ_BACKEND, read_df as read_replica_df
 import os
+import threading
+from export_energy import register_export_route
+from tables_energy import build_tables, build_views, view_records, view_stores, country_view
+from snapshot_energy import SNAPSHOT_DIR, SnapshotWatcher
 
 # ------------------------------
 # Connessione al DB
@@ -16,6 +20,13 @@ if not DB_URL:
 engine = create_engine(DB_URL)
 
 def fetch_df(query):
+    # Con READ_BACKEND=duckdb le letture vanno sulla replica Parquet locale;
+    # se la replica non ha la tabella (o non è disponibile) si torna a PostgreSQL
+    if READ_BACKEND == "duckdb":
+        try:
+            return read_replica_df(query)
+        except Exception as e:
+            print("Replica non disponibile, lettura da PostgreSQL:", e)
     try:
         return pd.read_sql(query, engine)
     except Exception as e:
@@ -25,106 +36,24 @@ def fetch_df(query):
 # ------------------------------
 # Caricamento dati
 # ------------------------------
-consumption = fetch_df("SELECT country_code, timestamp, consumption_mwh FROM consumption;")
-production = fetch_df("""
-SELECT p.country_code, e.source_name, p.timestamp, p.production_mwh
-FROM production p
-JOIN energy_sources e ON p.source_id = e.source_id;
-""")
-flows = fetch_df("SELECT from_country, to_country, timestamp, flow_mwh FROM crossborder_flows;")
+# Con SNAPSHOT_DIR impostata le viste del layout arrivano dallo snapshot Arrow generato
+# dopo l'ingestion (memory-map, nessuna query né pivot all'avvio); altrimenti si calcolano dal DB.
+snapshot_watcher = SnapshotWatcher() if SNAPSHOT_DIR else None
 
-# ------------------------------
-# Preprocessing
-# ------------------------------
-for df in [consumption, production, flows]:
-    if not df.empty:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-
-# Aggiungi colonna 'date' per evitare errori
-if not consumption.empty:
-    consumption['date'] = consumption['timestamp'].dt.date
-if not production.empty:
-    production['date'] = production['timestamp'].dt.date
-if not flows.empty:
-    flows['date'] = flows['timestamp'].dt.date
-
-# ------------------------------
-# KPI per paese
-# ------------------------------
-kpi_list = []
-countries = consumption['country_code'].unique() if not consumption.empty else []
-
-for country in countries:
-    cons_country = consumption[consumption['country_code'] == country].copy()
-    prod_country = production[production['country_code'] == country].copy()
-    net_country = flows[(flows['from_country'] == country) | (flows['to_country'] == country)].copy() if not flows.empty else pd.DataFrame()
-
-    # Rimuovo timezone
-    cons_country['timestamp'] = cons_country['timestamp'].dt.tz_convert(None)
-    prod_country['timestamp'] = prod_country['timestamp'].dt.tz_convert(None)
-    if not net_country.empty:
-        net_country['timestamp'] = net_country['timestamp'].dt.tz_convert(None)
-
-    # Periodi
-    cons_country['month_start'] = cons_country['timestamp'].dt.to_period('M').dt.start_time
-    cons_country['year'] = cons_country['timestamp'].dt.year
-
-    # Totali giornalieri, mensili, annuali
-    daily_totals = cons_country.groupby('date')['consumption_mwh'].sum().reset_index(name='total')
-    daily_totals['avg'] = daily_totals['total'].mean()
-    monthly_totals = cons_country.groupby('month_start')['consumption_mwh'].sum().reset_index(name='total')
-    monthly_totals['avg'] = monthly_totals['total'].mean()
-    yearly_totals = cons_country.groupby('year')['consumption_mwh'].sum().reset_index(name='total')
-    yearly_totals['avg'] = daily_totals['total'].mean()  # media giornaliera complessiva
-
-    # KPI Produzione
-    total_prod = prod_country['production_mwh'].sum()
-    energy_mix = prod_country.groupby('source_name')['production_mwh'].sum()
-    energy_mix_percent = (energy_mix / energy_mix.sum() * 100).round(1).to_dict() if not energy_mix.empty else {}
-
-    # Import ed Export annuali
-    if not net_country.empty:
-        net_country['year'] = net_country['timestamp'].dt.year
-
-        yearly_import = (
-            net_country[net_country['to_country'] == country]
-            .groupby('year')['flow_mwh']
-            .sum()
-            .reset_index(name='Import')
-        )
+def load_views():
+    if snapshot_watcher and (snapshot_watcher.refresh() or snapshot_watcher.tables is not None):
+        return snapshot_watcher.records()
+    return view_records(build_views(build_tables(fetch_df)))
 
-        yearly_export = (
-            net_country[net_country['from_country'] == country]
-            .groupby('year')['flow_mwh']
-            .sum()
-            .reset_index(name='Export')
-        )
-
-        # Merge con yearly_totals
-        yearly_totals = yearly_totals.merge(yearly_import, on='year', how='left') \
-                                     .merge(yearly_export, on='year', how='left')
-        yearly_totals[['Import','Export']] = yearly_totals[['Import','Export']].fillna(0)
-        yearly_totals['Net Import/Export'] = yearly_totals['Import'] - yearly_totals['Export']
-    else:
-        yearly_totals['Import'] = 0
-        yearly_totals['Export'] = 0
-        yearly_totals['Net Import/Export'] = 0
-
-    # Append a kpi_list
-    kpi_list.append({
-        'country': country,
-        'daily': daily_totals,
-        'monthly': monthly_totals,
-        'yearly': yearly_totals,
-        'total_prod': total_prod,
-        'energy_mix_percent': energy_mix_percent
-    })
 # ------------------------------
 # Dash App
 # ------------------------------
 app = dash.Dash(__name__)
 app.title = "Energy Dashboard"
 
+# Download in streaming (CSV gzip / Parquet) direttamente dal DB
+register_export_route(app.server, engine)
+
 def kpi_box(title, value, subtitle=None):
     display_value = f"{value:,.2f}" if isinstance(value, (int,float)) else str(value)
     return html.Div([
@@ -136,215 +65,242 @@ def kpi_box(title, value, subtitle=None):
         'flex':'1','textAlign':'center','backgroundColor':'#f9f9f9','boxShadow':'2px 2px 5px rgba(0,0,0,0.1)'
     })
 
+def rolling_kpi_row(kpi_rolling, country):
+    row = next((r for r in kpi_rolling if r['country_code'] == country), None)
+    if row is None:
+        return html.Div()
+    def val(col):
+        return '-' if pd.isna(row[col]) else row[col]
+    return html.Div([
+        kpi_box('Avg daily load 7d', val('avg_7d'), 'MWh/day'),
+        kpi_box('Avg daily load 30d', val('avg_30d'), 'MWh/day'),
+        kpi_box('Avg daily load 365d', val('avg_365d'), 'MWh/day'),
+        kpi_box('Peak load', val('peak_load_mw'), 'MW, 365d'),
+        kpi_box('Load factor', val('load_factor'), '365d'),
+        kpi_box('Renewable share', val('renewable_share'), '%, 30d'),
+        kpi_box('YoY load', val('yoy_delta_pct'), '%, 30d vs last year')
+    ], style={'display':'flex','flexWrap':'wrap','marginBottom':'10px'})
+
 # ------------------------------
-# Tabs layout
+# Dati per i grafici (dcc.Store)
 # ------------------------------
-tabs_children = []
-
-# --- KPI Tab ---
-kpi_sections = []
-for kpi in kpi_list:
-    country = kpi['country']
+# I grafici della tab Visuals sono disegnati da callback lato client
+# (assets/clientside.js): il server invia i dati una volta con il layout e
+# unità, fonti, percentuale e pro capite si cambiano senza round-trip.
+# I payload sono preparati da tables_energy.visual_stores (o letti dallo snapshot).
+UNITS = ['MWh', 'GWh', 'TWh']
+POPULATION = {"FR": 68_400_000, "DE": 84_500_000}
+
+def view_controls(sources):
+    return html.Div([
+        html.Div([
+            html.Span('Unit: ', style={'fontWeight':'bold'}),
+            dcc.RadioItems(id='unit', options=UNITS, value='MWh', inline=True)
+        ], style={'marginRight':'30px'}),
+        html.Div([
+            html.Span('Energy mix: ', style={'fontWeight':'bold'}),
+            dcc.RadioItems(id='mix-mode', options=[
+                {'label':'Absolute','value':'absolute'},
+                {'label':'Percentage','value':'percent'}
+            ], value='absolute', inline=True)
+        ], style={'marginRight':'30px'}),
+        dcc.Checklist(id='per-capita', options=[{'label':'Per capita','value':'per_capita'}], value=[], inline=True),
+        html.Div([
+            html.Span('Sources: ', style={'fontWeight':'bold'}),
+            dcc.Checklist(id='mix-sources', options=sources, value=sources, inline=True)
+        ], style={'flexBasis':'100%','marginTop':'10px'})
+    ], style={'display':'flex','flexWrap':'wrap','alignItems':'center','fontSize':'14px','marginBottom':'10px'})
 
-    # ----------------- Consumption -----------------
-    daily_table = dash_table.DataTable(
-        columns=[{"name": i, "id": i} for i in kpi['daily'].columns],
-        data=kpi['daily'].to_dict('records'), page_size=10, style_table={'overflowX':'auto'}
-    )
-    monthly_table = dash_table.DataTable(
-        columns=[{"name": i, "id": i} for i in kpi['monthly'].columns],
-        data=kpi['monthly'].to_dict('records'), page_size=10, style_table={'overflowX':'auto'}
-    )
-    yearly_table = dash_table.DataTable(
-        columns=[{"name": i, "id": i} for i in kpi['yearly'].columns],
-        data=kpi['yearly'].to_dict('records'), page_size=10, style_table={'overflowX':'auto'}
-    )
+def download_links(dataset):
+    return html.Div([
+        html.A("Download CSV", href=f"/export?dataset={dataset}&format=csv", style={'marginRight':'15px'}),
+        html.A("Download Parquet", href=f"/export?dataset={dataset}&format=parquet")
+    ], style={'fontSize':'12px','marginBottom':'10px'})
 
-    consumption_tab = dcc.Tabs([
-        dcc.Tab(label='Daily', children=html.Div([daily_table], style={'padding':'10px'})),
-        dcc.Tab(label='Monthly', children=html.Div([monthly_table], style={'padding':'10px'})),
-        dcc.Tab(label='Yearly', children=html.Div([yearly_table], style={'padding':'10px'}))
-    ])
-
-    # --------------- Production & Energy Mix -----------------
-    prod_country = production[production['country_code'] == country].copy()
-    if not prod_country.empty:
-        prod_country['month_start'] = prod_country['timestamp'].dt.to_period('M').dt.start_time
-        prod_country['year'] = prod_country['timestamp'].dt.year
-
-        prod_daily = prod_country.groupby(['date','source_name'])['production_mwh'].sum().reset_index()
-        prod_monthly = prod_country.groupby(['month_start','source_name'])['production_mwh'].sum().reset_index()
-        prod_yearly = prod_country.groupby(['year','source_name'])['production_mwh'].sum().reset_index()
-
-        prod_daily_table = dash_table.DataTable(
-            columns=[{"name": i, "id": i} for i in prod_daily.columns],
-            data=prod_daily.to_dict('records'), page_size=10, style_table={'overflowX':'auto'}
+# ------------------------------
+# Tabs layout
+# ------------------------------
+def record_columns(rows):
+    return [{"name": i, "id": i} for i in (rows[0] if rows else [])]
+
+def build_layout(views):
+    tabs_children = []
+
+    # --- KPI Tab ---
+    kpi_sections = []
+    countries = [row['country'] for row in views['countries']]
+    for country in countries:
+        daily = views[country_view('consumption_daily', country)]
+        monthly = views[country_view('consumption_monthly', country)]
+        yearly = views[country_view('consumption_yearly', country)]
+
+        # ----------------- Consumption -----------------
+        daily_table = dash_table.DataTable(
+            columns=record_columns(daily),
+            data=daily, page_size=10, style_table={'overflowX':'auto'}
         )
-        prod_monthly_table = dash_table.DataTable(
-            columns=[{"name": i, "id": i} for i in prod_monthly.columns],
-            data=prod_monthly.to_dict('records'), page_size=10, style_table={'overflowX':'auto'}
+        monthly_table = dash_table.DataTable(
+            columns=record_columns(monthly),
+            data=monthly, page_size=10, style_table={'overflowX':'auto'}
         )
-        prod_yearly_table = dash_table.DataTable(
-            columns=[{"name": i, "id": i} for i in prod_yearly.columns],
-            data=prod_yearly.to_dict('records'), page_size=10, style_table={'overflowX':'auto'}
+        yearly_table = dash_table.DataTable(
+            columns=record_columns(yearly),
+            data=yearly, page_size=10, style_table={'overflowX':'auto'}
         )
 
-        production_tab = dcc.Tabs([
-            dcc.Tab(label='Daily', children=html.Div([prod_daily_table], style={'padding':'10px'})),
-            dcc.Tab(label='Monthly', children=html.Div([prod_monthly_table], style={'padding':'10px'})),
-            dcc.Tab(label='Yearly', children=html.Div([prod_yearly_table], style={'padding':'10px'}))
+        consumption_tab = dcc.Tabs([
+            dcc.Tab(label='Daily', children=html.Div([daily_table], style={'padding':'10px'})),
+            dcc.Tab(label='Monthly', children=html.Div([monthly_table], style={'padding':'10px'})),
+            dcc.Tab(label='Yearly', children=html.Div([yearly_table], style={'padding':'10px'}))
         ])
-    else:
-        production_tab = html.Div("No production data", style={'padding':'10px'})
-
-    # ----------------- Net Flows -----------------
-    net_df = kpi['yearly'][['year','Import','Export','Net Import/Export']].copy()
-    net_table = dash_table.DataTable(
-        columns=[{"name": i, "id": i} for i in net_df.columns],
-        data=net_df.to_dict('records'),
+
+        # --------------- Production & Energy Mix -----------------
+        prod_daily = views[country_view('production_daily', country)]
+        if prod_daily:
+            prod_monthly = views[country_view('production_monthly', country)]
+            prod_yearly = views[country_view('production_yearly', country)]
+
+            prod_daily_table = dash_table.DataTable(
+                columns=record_columns(prod_daily),
+                data=prod_daily, page_size=10, style_table={'overflowX':'auto'}
+            )
+            prod_monthly_table = dash_table.DataTable(
+                columns=record_columns(prod_monthly),
+                data=prod_monthly, page_size=10, style_table={'overflowX':'auto'}
+            )
+            prod_yearly_table = dash_table.DataTable(
+                columns=record_columns(prod_yearly),
+                data=prod_yearly, page_size=10, style_table={'overflowX':'auto'}
+            )
+
+            production_tab = dcc.Tabs([
+                dcc.Tab(label='Daily', children=html.Div([prod_daily_table], style={'padding':'10px'})),
+                dcc.Tab(label='Monthly', children=html.Div([prod_monthly_table], style={'padding':'10px'})),
+                dcc.Tab(label='Yearly', children=html.Div([prod_yearly_table], style={'padding':'10px'}))
+            ])
+        else:
+            production_tab = html.Div("No production data", style={'padding':'10px'})
+
+        # ----------------- Net Flows -----------------
+        net_yearly = views[country_view('net_yearly', country)]
+        net_table = dash_table.DataTable(
+            columns=record_columns(net_yearly),
+            data=net_yearly,
+            page_size=10,
+            style_table={'overflowX':'auto'}
+        )
+        net_tab = dcc.Tabs([dcc.Tab(label='Yearly Net', children=html.Div([net_table], style={'padding':'10px'}))])
+
+        # ----------------- Sezione paese -----------------
+        kpi_sections.append(
+            html.Div([
+                html.H3(f"{country}", style={'textAlign':'center','marginBottom':'10px'}),
+                rolling_kpi_row(views['kpi_rolling'], country),
+                dcc.Tabs([
+                    dcc.Tab(label='Consumption', children=consumption_tab),
+                    dcc.Tab(label='Production & Energy Mix', children=production_tab),
+                    dcc.Tab(label='Net Flows', children=net_tab)
+                ])
+            ], style={'marginBottom':'30px'})
+        )
+
+    tabs_children.append(dcc.Tab(label='KPIs', children=html.Div(kpi_sections, style={'padding':'20px'})))
+
+    # --- Visuals Tab ---
+    stores = view_stores(views)
+    tabs_children.append(dcc.Tab(label='Visuals', children=html.Div([
+        dcc.Store(id='time-store', data=stores['time']),
+        dcc.Store(id='mix-store', data=stores['mix']),
+        dcc.Store(id='net-store', data=stores['net']),
+        dcc.Store(id='heat-store', data=stores['heat']),
+        dcc.Store(id='population-store', data=POPULATION),
+        view_controls(stores['sources']),
+        dcc.Graph(id='fig-time'),
+        dcc.Graph(id='fig-mix'),
+        dcc.Graph(id='fig-net'),
+        dcc.Graph(id='fig-heat')
+    ], style={'padding':'20px'})))
+
+    # --- Tables Tab ---
+    daily_table = views['daily_table']
+    flows = views['flows']
+
+    daily_dash_table = dash_table.DataTable(
+        columns=record_columns(daily_table),
+        data=daily_table,
         page_size=10,
+        sort_action='native',
+        filter_action='native',
         style_table={'overflowX':'auto'}
     )
-    net_tab = dcc.Tabs([dcc.Tab(label='Yearly Net', children=html.Div([net_table], style={'padding':'10px'}))])
 
-    # ----------------- Sezione paese -----------------
-    kpi_sections.append(
-        html.Div([
-            html.H3(f"{country}", style={'textAlign':'center','marginBottom':'10px'}),
-            dcc.Tabs([
-                dcc.Tab(label='Consumption', children=consumption_tab),
-                dcc.Tab(label='Production & Energy Mix', children=production_tab),
-                dcc.Tab(label='Net Flows', children=net_tab)
-            ])
-        ], style={'marginBottom':'30px'})
+    flows_dash_table = dash_table.DataTable(
+        columns=record_columns(flows),
+        data=flows,
+        page_size=10,
+        sort_action='native',
+        filter_action='native',
+        style_table={'overflowX':'auto'}
     )
 
-tabs_children.append(dcc.Tab(label='KPIs', children=html.Div(kpi_sections, style={'padding':'20px'})))
+    tabs_children.append(dcc.Tab(label='Tables', children=html.Div([
+        html.H3("Daily Consumption & Production with Net Balance"),
+        download_links('daily'),
+        daily_dash_table,
+        html.H3("Cross-Border Flows"),
+        download_links('flows'),
+        flows_dash_table
+    ], style={'padding':'20px'})))
+
+    # ------------------------------
+    # Layout finale
+    # ------------------------------
+    return html.Div([
+        html.H1("Energy Dashboard", style={'textAlign':'center', 'marginBottom':'20px'}),
+        dcc.Tabs(tabs_children)
+    ], style={'maxWidth':'1200px','margin':'auto','fontFamily':'Arial, sans-serif'})
 
-# --- Visuals Tab ---
-if not consumption.empty and not production.empty:
-    daily_cons = consumption.groupby(['country_code','date']).agg(total_mwh_cons=('consumption_mwh','sum')).reset_index()
-    daily_prod = production.groupby(['country_code','date']).agg(total_mwh_prod=('production_mwh','sum')).reset_index()
-    time_df = pd.merge(daily_cons, daily_prod, on=['country_code','date'], how='outer')
-    for col in ['total_mwh_cons','total_mwh_prod']:
-        if col not in time_df.columns:
-            time_df[col] = 0.0
-        else:
-            time_df[col] = time_df[col].astype(float)
-    fig_time = px.line(
-        time_df, x='date', y=['total_mwh_cons','total_mwh_prod'],
-        color='country_code', labels={'value':'MWh','variable':'Serie','date':'Data'},
-        title='Time series: consumption vs. production'
-    )
-else:
-    fig_time = px.line(title='No data for time series')
-
-# Production mix
-fig_mix = px.area(
-    production, x='timestamp', y='production_mwh', color='source_name',
-    facet_col='country_code', title='Stacked area: production mix',
-    labels={'production_mwh':'MWh','source_name':'Fonte'}
-) if not production.empty else px.area(title='No production data')
-
-# Net balance
-if not flows.empty:
-    total_export = flows.groupby('from_country')['flow_mwh'].sum().reset_index(name='export')
-    total_import = flows.groupby('to_country')['flow_mwh'].sum().reset_index(name='import')
-    net_balance = pd.merge(total_export, total_import, left_on='from_country', right_on='to_country', how='outer').fillna(0)
-    net_balance['country'] = net_balance['from_country'].combine_first(net_balance['to_country'])
-    net_balance['export'] = -net_balance['export']
-    net_balance['net_balance'] = net_balance['import'] + net_balance['export']
-    net_balance = net_balance[['country','export','import','net_balance']]
-    fig_net = px.bar(
-        net_balance.melt(id_vars='country', value_vars=['export','import','net_balance']),
-        x='country', y='value', color='variable',
-        barmode='group', title='Bar chart: net flows by country'
-    )
-else:
-    fig_net = px.bar(title='No flow data')
-
-# Heatmap consumo orario
-if not consumption.empty:
-    consumption['hour'] = consumption['timestamp'].dt.hour
-    consumption['day'] = consumption['timestamp'].dt.date
-    heatmap_data = consumption.groupby(['country_code','day','hour']).agg(total_mwh=('consumption_mwh','sum')).reset_index()
-    fig_heat = px.density_heatmap(
-        heatmap_data, x='hour', y='day', z='total_mwh',
-        facet_col='country_code', labels={'hour':'Ora','day':'Giorno','total_mwh':'MWh'},
-        title='Heatmap: hourly consumption patterns'
-    )
-else:
-    fig_heat = px.density_heatmap(title='No consumption data')
-
- 
-
-tabs_children.append(dcc.Tab(label='Visuals', children=html.Div([
-    dcc.Graph(figure=fig_time),
-    dcc.Graph(figure=fig_mix),
-    dcc.Graph(figure=fig_net),
-    dcc.Graph(figure=fig_heat)
-], style={'padding':'20px'})))
-
-# --- Tables Tab ---
-# Daily aggregation
-if not consumption.empty and not production.empty:
-    daily_cons = consumption.groupby(['country_code','date']).agg(total_mwh_cons=('consumption_mwh','sum')).reset_index()
-    daily_prod = production.groupby(['country_code','date']).agg(total_mwh_prod=('production_mwh','sum')).reset_index()
-    daily_table = pd.merge(daily_cons, daily_prod, on=['country_code','date'], how='outer')
-else:
-    daily_table = pd.DataFrame()
-
-# Net balance giornaliero
-if not flows.empty:
-    flows['date'] = flows['timestamp'].dt.date
-    daily_export = flows.groupby(['from_country','date']).agg(export=('flow_mwh','sum')).reset_index()
-    daily_import = flows.groupby(['to_country','date']).agg(import_=('flow_mwh','sum')).reset_index()
-    net_daily = pd.merge(daily_export, daily_import, left_on=['from_country','date'], right_on=['to_country','date'], how='outer').fillna(0)
-    net_daily['country'] = net_daily['from_country'].combine_first(net_daily['to_country'])
-    net_daily['export'] = -net_daily['export']
-    net_daily['net_balance'] = net_daily['import_'] + net_daily['export']
-    daily_table = pd.merge(
-        daily_table,
-        net_daily[['country','date','export','import_','net_balance']],
-        left_on=['country_code','date'],
-        right_on=['country','date'], how='left'
-    ).drop(columns='country')
-else:
-    for col in ['export','import_','net_balance']:
-        daily_table[col] = 0
-
-daily_dash_table = dash_table.DataTable(
-    columns=[{"name": i, "id": i} for i in daily_table.columns],
-    data=daily_table.to_dict('records'),
-    page_size=10,
-    sort_action='native',
-    filter_action='native',
-    style_table={'overflowX':'auto'}
-)
+current_layout = build_layout(load_views())
+layout_lock = threading.Lock()
 
-flows_dash_table = dash_table.DataTable(
-    columns=[{"name":i,"id":i} for i in flows.columns],
-    data=flows.to_dict('records'),
-    page_size=10,
-    sort_action='native',
-    filter_action='native',
-    style_table={'overflowX':'auto'}
-)
+def serve_layout():
+    # Hot-swap: se è comparso uno snapshot più recente il layout viene ricostruito al prossimo caricamento pagina
+    global current_layout
+    if snapshot_watcher and snapshot_watcher.refresh():
+        with layout_lock:
+            current_layout = build_layout(snapshot_watcher.records())
+    return current_layout
 
-tabs_children.append(dcc.Tab(label='Tables', children=html.Div([
-    html.H3("Daily Consumption & Production with Net Balance"),
-    daily_dash_table,
-    html.H3("Cross-Border Flows"),
-    flows_dash_table
-], style={'padding':'20px'})))
+app.layout = serve_layout
 
 # ------------------------------
-# Layout finale
+# Callback lato client (assets/clientside.js)
 # ------------------------------
-app.layout = html.Div([
-    html.H1("Energy Dashboard", style={'textAlign':'center', 'marginBottom':'20px'}),
-    dcc.Tabs(tabs_children)
-], style={'maxWidth':'1200px','margin':'auto','fontFamily':'Arial, sans-serif'})
+app.clientside_callback(
+    ClientsideFunction(namespace='energy', function_name='timeSeries'),
+    Output('fig-time', 'figure'),
+    Input('time-store', 'data'), Input('unit', 'value'), Input('per-capita', 'value'),
+    State('population-store', 'data')
+)
+app.clientside_callback(
+    ClientsideFunction(namespace='energy', function_name='productionMix'),
+    Output('fig-mix', 'figure'),
+    Input('mix-store', 'data'), Input('unit', 'value'), Input('mix-mode', 'value'),
+    Input('mix-sources', 'value'), Input('per-capita', 'value'),
+    State('population-store', 'data')
+)
+app.clientside_callback(
+    ClientsideFunction(namespace='energy', function_name='netBalance'),
+    Output('fig-net', 'figure'),
+    Input('net-store', 'data'), Input('unit', 'value'), Input('per-capita', 'value'),
+    State('population-store', 'data')
+)
+app.clientside_callback(
+    ClientsideFunction(namespace='energy', function_name='heatmap'),
+    Output('fig-heat', 'figure'),
+    Input('heat-store', 'data'), Input('unit', 'value'), Input('per-capita', 'value'),
+    State('population-store', 'data')
+)
 
 # ------------------------------
 # Avvio server
@@ -0,0 +1,115 @@
+import pandas as pd
+
+# ------------------------------
+# Intervalli di date modificati
+# ------------------------------
+# Ogni scrittura che inserisce o aggiorna righe registra qui i giorni (UTC)
+# toccati, così gli aggregati a valle possono essere ricalcolati solo dove serve.
+# I consumatori tengono il proprio watermark sulla transazione che ha scritto la
+# riga (tx_id), non su range_id: un range_id basso può essere committato dopo uno
+# più alto da una transazione lunga, e un watermark su MAX(range_id) lo perderebbe.
+# Le righe sotto il watermark di tutti i consumatori registrati vengono cancellate;
+# un consumatore dismesso va tolto da dirty_ranges_watermarks, altrimenti blocca la pulizia.
+def ensure_dirty_ranges_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dirty_ranges (
+                range_id SERIAL PRIMARY KEY,
+                dataset TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                range_start DATE NOT NULL,
+                range_end DATE NOT NULL,
+                marked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                tx_id xid8 NOT NULL DEFAULT pg_current_xact_id()
+            );
+            CREATE TABLE IF NOT EXISTS dirty_ranges_watermarks (
+                consumer TEXT PRIMARY KEY,
+                last_tx xid8 NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        # Tabella creata dalle versioni precedenti: ALTER solo se manca la colonna,
+        # altrimenti il lock esclusivo attenderebbe ogni scrittura in corso
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'dirty_ranges' AND column_name = 'tx_id';
+        """)
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE dirty_ranges ADD COLUMN tx_id xid8 NOT NULL DEFAULT pg_current_xact_id();")
+        cursor.execute("SELECT to_regclass('dirty_ranges_tx_id');")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("CREATE INDEX dirty_ranges_tx_id ON dirty_ranges(tx_id);")
+    conn.commit()
+
+def date_ranges(timestamps):
+    # Raggruppa i giorni distinti in intervalli contigui [range_start, range_end]
+    if len(timestamps) == 0:
+        return []
+    days = pd.DatetimeIndex(pd.to_datetime(pd.Series(timestamps), utc=True)).normalize().unique().sort_values()
+    breaks = days.to_series().diff() != pd.Timedelta(days=1)
+    group = breaks.cumsum().to_numpy()
+    ranges = []
+    for g in pd.unique(group):
+        block = days[group == g]
+        ranges.append((block[0].date(), block[-1].date()))
+    return ranges
+
+def mark_dirty_ranges(cursor, dataset, country_codes, timestamps):
+    # Usa il cursore del chiamante: la marcatura fa parte della stessa transazione della scrittura
+    ranges = date_ranges(timestamps)
+    for country_code in country_codes:
+        for range_start, range_end in ranges:
+            cursor.execute("""
+                INSERT INTO dirty_ranges(dataset, country_code, range_start, range_end)
+                VALUES (%s, %s, %s, %s);
+            """, (dataset, country_code, range_start, range_end))
+    return ranges
+
+def load_dirty_ranges(conn, after_tx=None, datasets=None):
+    # Righe scritte da transazioni in [after_tx, xmin), dove xmin è la più vecchia
+    # transazione ancora aperta: tutte quelle precedenti sono concluse, quindi le loro
+    # righe sono già visibili (o annullate). Il nuovo watermark del consumatore è xmin;
+    # le transazioni ancora aperte verranno lette al giro successivo.
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            WITH s AS (SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xmin)
+            SELECT r.range_id, r.dataset, r.country_code, r.range_start, r.range_end, s.xmin::text
+            FROM s
+            LEFT JOIN dirty_ranges r
+                   ON r.tx_id < s.xmin
+                  AND (%(after_tx)s::xid8 IS NULL OR r.tx_id >= %(after_tx)s::xid8)
+                  AND (%(datasets)s::text[] IS NULL OR r.dataset = ANY(%(datasets)s::text[]))
+            ORDER BY r.range_id;
+        """, {"after_tx": after_tx, "datasets": list(datasets) if datasets else None})
+        rows = cursor.fetchall()
+    upto_tx = rows[0][-1]
+    ranges = pd.DataFrame([row[:-1] for row in rows if row[0] is not None],
+                          columns=["range_id", "dataset", "country_code", "range_start", "range_end"])
+    return ranges, upto_tx
+
+def snapshot_xmin(cursor):
+    cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text;")
+    return cursor.fetchone()[0]
+
+# ------------------------------
+# Watermark dei consumatori
+# ------------------------------
+def get_watermark(cursor, consumer):
+    cursor.execute("SELECT last_tx::text FROM dirty_ranges_watermarks WHERE consumer = %s;", (consumer,))
+    res = cursor.fetchone()
+    return res[0] if res else None
+
+def set_watermark(cursor, consumer, tx):
+    cursor.execute("""
+        INSERT INTO dirty_ranges_watermarks(consumer, last_tx) VALUES (%s, %s::xid8)
+        ON CONFLICT (consumer) DO UPDATE SET last_tx = EXCLUDED.last_tx, updated_at = now();
+    """, (consumer, tx))
+    prune_dirty_ranges(cursor)
+
+def prune_dirty_ranges(cursor):
+    # Righe già lette da tutti i consumatori: tx_id sotto il watermark più basso
+    cursor.execute("""
+        DELETE FROM dirty_ranges
+        WHERE tx_id < (SELECT MIN(last_tx) FROM dirty_ranges_watermarks);
+    """)
+    return cursor.rowcount
@@ -0,0 +1,288 @@
+import csv
+import io
+import itertools
+import logging
+import uuid
+import zlib
+
+import pandas as pd
+from flask import Response, request
+
+from hourly_grid import grid_built
+
+# ------------------------------
+# Dataset esportabili
+# ------------------------------
+# Ogni dataset: query con filtri paese/periodo e tipi delle colonne (per lo schema Parquet).
+# Con "hourly" la query legge la griglia oraria (MWh, gli stessi numeri della dashboard)
+# e ripiega sulle tabelle grezze finché la griglia non è stata costruita.
+DATASETS = {
+    "consumption": {
+        "hourly": True,
+        "query": """
+            SELECT country_code, timestamp, consumption_mwh
+            FROM consumption{suffix}
+            WHERE (%(countries)s::text[] IS NULL OR country_code = ANY(%(countries)s::text[]))
+              AND timestamp >= %(start)s AND timestamp < %(end)s
+            ORDER BY country_code, timestamp
+        """,
+        "columns": [("country_code", "string"), ("timestamp", "timestamp"), ("consumption_mwh", "float")],
+    },
+    "production": {
+        "hourly": True,
+        "query": """
+            SELECT p.country_code, e.source_name, p.timestamp, p.production_mwh
+            FROM production{suffix} p
+            JOIN energy_sources e ON p.source_id = e.source_id
+            WHERE (%(countries)s::text[] IS NULL OR p.country_code = ANY(%(countries)s::text[]))
+              AND p.timestamp >= %(start)s AND p.timestamp < %(end)s
+            ORDER BY p.country_code, e.source_name, p.timestamp
+        """,
+        "columns": [("country_code", "string"), ("source_name", "string"),
+                    ("timestamp", "timestamp"), ("production_mwh", "float")],
+    },
+    "flows": {
+        "hourly": True,
+        "query": """
+            SELECT from_country, to_country, timestamp, flow_mwh
+            FROM crossborder_flows{suffix}
+            WHERE (%(countries)s::text[] IS NULL OR from_country = ANY(%(countries)s::text[]) OR to_country = ANY(%(countries)s::text[]))
+              AND timestamp >= %(start)s AND timestamp < %(end)s
+            ORDER BY from_country, to_country, timestamp
+        """,
+        "columns": [("from_country", "string"), ("to_country", "string"),
+                    ("timestamp", "timestamp"), ("flow_mwh", "float")],
+    },
+    # Dati grezzi alla risoluzione nativa ENTSO-E (15/30/60 minuti): potenze medie in MW
+    # del periodo, non energie. Le colonne sono rinominate di conseguenza
+    "consumption_mw": {
+        "query": """
+            SELECT country_code, timestamp, consumption_mwh AS consumption_mw
+            FROM consumption
+            WHERE (%(countries)s::text[] IS NULL OR country_code = ANY(%(countries)s::text[]))
+              AND timestamp >= %(start)s AND timestamp < %(end)s
+            ORDER BY country_code, timestamp
+        """,
+        "columns": [("country_code", "string"), ("timestamp", "timestamp"), ("consumption_mw", "float")],
+    },
+    "production_mw": {
+        "query": """
+            SELECT p.country_code, e.source_name, p.timestamp, p.production_mwh AS production_mw
+            FROM production p
+            JOIN energy_sources e ON p.source_id = e.source_id
+            WHERE (%(countries)s::text[] IS NULL OR p.country_code = ANY(%(countries)s::text[]))
+              AND p.timestamp >= %(start)s AND p.timestamp < %(end)s
+            ORDER BY p.country_code, e.source_name, p.timestamp
+        """,
+        "columns": [("country_code", "string"), ("source_name", "string"),
+                    ("timestamp", "timestamp"), ("production_mw", "float")],
+    },
+    "flows_mw": {
+        "query": """
+            SELECT from_country, to_country, timestamp, flow_mwh AS flow_mw
+            FROM crossborder_flows
+            WHERE (%(countries)s::text[] IS NULL OR from_country = ANY(%(countries)s::text[]) OR to_country = ANY(%(countries)s::text[]))
+              AND timestamp >= %(start)s AND timestamp < %(end)s
+            ORDER BY from_country, to_country, timestamp
+        """,
+        "columns": [("from_country", "string"), ("to_country", "string"),
+                    ("timestamp", "timestamp"), ("flow_mw", "float")],
+    },
+    # Stessa tabella giornaliera della tab Tables, calcolata lato DB sulla griglia oraria
+    "daily": {
+        "hourly": True,
+        "query": """
+            WITH cons AS (
+                SELECT country_code, (timestamp AT TIME ZONE 'UTC')::date AS date, SUM(consumption_mwh) AS total_mwh_cons
+                FROM consumption{suffix}
+                WHERE timestamp >= %(start)s AND timestamp < %(end)s
+                GROUP BY 1, 2
+            ), prod AS (
+                SELECT country_code, (timestamp AT TIME ZONE 'UTC')::date AS date, SUM(production_mwh) AS total_mwh_prod
+                FROM production{suffix}
+                WHERE timestamp >= %(start)s AND timestamp < %(end)s
+                GROUP BY 1, 2
+            ), fl AS (
+                SELECT country_code, date, SUM(export) AS export, SUM(import_) AS import_
+                FROM (
+                    SELECT from_country AS country_code, (timestamp AT TIME ZONE 'UTC')::date AS date,
+                           -flow_mwh AS export, 0 AS import_
+                    FROM crossborder_flows{suffix}
+                    WHERE timestamp >= %(start)s AND timestamp < %(end)s
+                    UNION ALL
+                    SELECT to_country, (timestamp AT TIME ZONE 'UTC')::date, 0, flow_mwh
+                    FROM crossborder_flows{suffix}
+                    WHERE timestamp >= %(start)s AND timestamp < %(end)s
+                ) f
+                GROUP BY 1, 2
+            )
+            SELECT COALESCE(c.country_code, p.country_code) AS country_code,
+                   COALESCE(c.date, p.date) AS date,
+                   c.total_mwh_cons, p.total_mwh_prod,
+                   fl.export, fl.import_, fl.import_ + fl.export AS net_balance
+            FROM cons c
+            FULL OUTER JOIN prod p ON c.country_code = p.country_code AND c.date = p.date
+            LEFT JOIN fl ON fl.country_code = COALESCE(c.country_code, p.country_code)
+                        AND fl.date = COALESCE(c.date, p.date)
+            WHERE (%(countries)s::text[] IS NULL OR COALESCE(c.country_code, p.country_code) = ANY(%(countries)s::text[]))
+            ORDER BY 1, 2
+        """,
+        "columns": [("country_code", "string"), ("date", "date"), ("total_mwh_cons", "float"),
+                    ("total_mwh_prod", "float"), ("export", "float"), ("import_", "float"),
+                    ("net_balance", "float")],
+    },
+}
+
+# Righe lette dal cursore server-side per ogni blocco (= un row group Parquet)
+CHUNK_ROWS = 50000
+
+# ------------------------------
+# Lettura a blocchi
+# ------------------------------
+def iter_chunks(engine, dataset, params, chunk_rows=CHUNK_ROWS):
+    # Cursore server-side: PostgreSQL invia le righe un blocco alla volta,
+    # la memoria del worker resta costante qualunque sia il periodo richiesto
+    conn = engine.raw_connection()
+    try:
+        query = DATASETS[dataset]["query"]
+        if DATASETS[dataset].get("hourly"):
+            with conn.cursor() as cursor:
+                query = query.format(suffix="_hourly" if grid_built(cursor) else "")
+        with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = chunk_rows
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        conn.close()
+
+def prefetch(chunks):
+    # Esegue la query e legge il primo blocco prima di inviare lo status:
+    # un errore SQL diventa un 500 invece di un file troncato con 200
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], chunks)
+
+def stream_csv_gz(chunks, columns):
+    gz = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # formato gzip
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for rows in chunks:
+        writer.writerows(rows)
+        data = gz.compress(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+        if data:
+            yield data
+    yield gz.compress(buffer.getvalue().encode("utf-8")) + gz.flush()
+
+class _ChunkSink(io.RawIOBase):
+    # File-like minimale: accumula i byte scritti da ParquetWriter finché non vengono inviati
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def stream_parquet(chunks, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"string": pa.string(), "timestamp": pa.timestamp("us", tz="UTC"),
+             "float": pa.float64(), "date": pa.date32()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for rows in chunks:
+            # Un row group per blocco, inviato appena scritto
+            batch = pa.table([list(col) for col in zip(*rows)], schema=schema)
+            writer.write_table(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+# ------------------------------
+# Route Flask
+# ------------------------------
+def parse_export_args(args):
+    dataset = args.get("dataset")
+    if dataset not in DATASETS:
+        raise ValueError(f"dataset non valido: {dataset}. Valori ammessi: {', '.join(DATASETS)}")
+    fmt = args.get("format", "csv")
+    if fmt not in ("csv", "parquet"):
+        raise ValueError(f"format non valido: {fmt}. Valori ammessi: csv, parquet")
+
+    countries = [c.strip().upper() for value in args.getlist("country") for c in value.split(",") if c.strip()]
+    start = pd.Timestamp(args.get("start", "1970-01-01"))
+    end = pd.Timestamp(args.get("end", "2100-01-01"))
+    # start= / end= vuoti diventano NaT: vanno rifiutati qui, non nella query
+    if pd.isna(start) or pd.isna(end):
+        raise ValueError("start e end devono essere date valide")
+    start = start.tz_localize("UTC") if start.tzinfo is None else start.tz_convert("UTC")
+    end = end.tz_localize("UTC") if end.tzinfo is None else end.tz_convert("UTC")
+    if end <= start:
+        raise ValueError("end deve essere successivo a start")
+
+    params = {
+        "countries": countries or None,
+        "start": start.to_pydatetime(),
+        "end": end.to_pydatetime(),
+    }
+    return dataset, fmt, params
+
+def register_export_route(server, engine, path="/export"):
+    # Es.: /export?dataset=flows&country=FR&start=2024-12-01&end=2025-01-01&format=parquet
+    @server.route(path)
+    def export_data():
+        try:
+            dataset, fmt, params = parse_export_args(request.args)
+        except ValueError as e:
+            return Response(f"Errore export: {e}\n", status=400, mimetype="text/plain")
+
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                return Response("Export Parquet non disponibile: pyarrow non installato\n",
+                                status=501, mimetype="text/plain")
+
+        columns = DATASETS[dataset]["columns"]
+        try:
+            chunks = prefetch(iter_chunks(engine, dataset, params))
+        except Exception as e:
+            logging.error(f"Errore export {dataset}: {e}")
+            return Response(f"Errore export {dataset}: query non riuscita\n", status=500, mimetype="text/plain")
+
+        if fmt == "parquet":
+            body = stream_parquet(chunks, columns)
+            filename, mimetype = f"{dataset}.parquet", "application/vnd.apache.parquet"
+        else:
+            body = stream_csv_gz(chunks, columns)
+            filename, mimetype = f"{dataset}.csv.gz", "application/gzip"
+
+        return Response(body, mimetype=mimetype, headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+        })
+
+    return export_data
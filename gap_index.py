@@ -0,0 +1,262 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+from psycopg2.extras import execute_values
+
+# ------------------------------
+# Serie monitorate
+# ------------------------------
+# Ogni dataset restituisce (key_1, key_2, timestamp) ordinati per serie:
+# production  -> (country_code, source_name)
+# consumption -> (country_code, '')
+# flows       -> (from_country, to_country)
+SERIES_QUERIES = {
+    "production": """
+        SELECT p.country_code, e.source_name, p.timestamp
+        FROM production p
+        JOIN energy_sources e ON p.source_id = e.source_id
+        WHERE (%(start)s::timestamptz IS NULL OR p.timestamp >= %(start)s)
+          AND (%(end)s::timestamptz IS NULL OR p.timestamp < %(end)s)
+        ORDER BY 1, 2, 3;
+    """,
+    "consumption": """
+        SELECT country_code, '', timestamp
+        FROM consumption
+        WHERE (%(start)s::timestamptz IS NULL OR timestamp >= %(start)s)
+          AND (%(end)s::timestamptz IS NULL OR timestamp < %(end)s)
+        ORDER BY 1, 3;
+    """,
+    "flows": """
+        SELECT from_country, to_country, timestamp
+        FROM crossborder_flows
+        WHERE (%(start)s::timestamptz IS NULL OR timestamp >= %(start)s)
+          AND (%(end)s::timestamptz IS NULL OR timestamp < %(end)s)
+        ORDER BY 1, 2, 3;
+    """,
+}
+
+KEY_COLS = ["key_1", "key_2"]
+
+# Risoluzione locale = mediana dei passi vicini della stessa serie: segue i
+# cambi di risoluzione (es. da orario a 15 minuti) e ignora i salti isolati
+RESOLUTION_WINDOW = 9
+# Margine letto prima della finestra, per avere i passi precedenti al suo inizio
+READ_MARGIN = pd.Timedelta(hours=RESOLUTION_WINDOW)
+
+# Dopo questo numero di tentativi di re-fetch a vuoto il buco viene
+# considerato definitivo (dato non pubblicato da ENTSO-E) e non più richiesto
+MAX_ATTEMPTS = 3
+
+# ------------------------------
+# Tabella dei buchi
+# ------------------------------
+def ensure_gap_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS data_gaps (
+                dataset TEXT NOT NULL,
+                key_1 TEXT NOT NULL,
+                key_2 TEXT NOT NULL DEFAULT '',
+                gap_start TIMESTAMPTZ NOT NULL,
+                gap_end TIMESTAMPTZ NOT NULL,
+                resolution_minutes INTEGER NOT NULL,
+                missing_intervals INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                detected_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (dataset, key_1, key_2, gap_start)
+            );
+        """)
+    conn.commit()
+
+# ------------------------------
+# Rilevamento (vettoriale)
+# ------------------------------
+def infer_resolution(df):
+    # Risoluzione attesa per riga: mediana dei RESOLUTION_WINDOW passi precedenti;
+    # a inizio serie (nessun passo precedente) quella dei passi successivi.
+    # interpolation="lower" restituisce sempre un passo realmente osservato.
+    def local(steps):
+        back = steps.shift(1).rolling(RESOLUTION_WINDOW, min_periods=1).quantile(0.5, interpolation="lower")
+        ahead = steps[::-1].shift(1).rolling(RESOLUTION_WINDOW, min_periods=1).quantile(0.5, interpolation="lower")[::-1]
+        return back.fillna(ahead).fillna(steps)
+
+    seconds = df["diff"].dt.total_seconds()
+    resolution = seconds.groupby([df[k] for k in KEY_COLS]).transform(local)
+    return pd.to_timedelta(resolution, unit="s")
+
+def to_utc(ts):
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+def detect_gaps(df, start=None, end=None):
+    # df: colonne key_1, key_2, timestamp. start/end opzionali per rilevare
+    # anche i buchi in testa e in coda rispetto alla finestra richiesta.
+    columns = KEY_COLS + ["gap_start", "gap_end", "resolution_minutes", "missing_intervals"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    df = df.copy()
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    df = df.drop_duplicates(KEY_COLS + ["timestamp"]).sort_values(KEY_COLS + ["timestamp"])
+    df["diff"] = df.groupby(KEY_COLS)["timestamp"].diff()
+
+    df["resolution"] = infer_resolution(df)
+    df = df.dropna(subset=["resolution"])  # serie con un solo punto
+
+    # Buchi interni: salto maggiore della risoluzione attesa
+    inner = df[df["diff"] > df["resolution"]]
+    gaps = pd.DataFrame({
+        "key_1": inner["key_1"],
+        "key_2": inner["key_2"],
+        "gap_start": inner["timestamp"] - inner["diff"] + inner["resolution"],
+        "gap_end": inner["timestamp"],
+        "resolution": inner["resolution"],
+    })
+
+    # Buchi in testa e in coda rispetto alla finestra
+    bounds = df.groupby(KEY_COLS).agg(
+        first=("timestamp", "min"), last=("timestamp", "max"),
+        first_resolution=("resolution", "first"), last_resolution=("resolution", "last")
+    ).reset_index()
+    edges = []
+    if start is not None:
+        start = to_utc(start)
+        head = bounds[bounds["first"] > start]
+        edges.append(pd.DataFrame({
+            "key_1": head["key_1"], "key_2": head["key_2"],
+            "gap_start": start, "gap_end": head["first"], "resolution": head["first_resolution"],
+        }))
+    if end is not None:
+        end = to_utc(end)
+        tail = bounds[bounds["last"] + bounds["last_resolution"] < end]
+        edges.append(pd.DataFrame({
+            "key_1": tail["key_1"], "key_2": tail["key_2"],
+            "gap_start": tail["last"] + tail["last_resolution"], "gap_end": end,
+            "resolution": tail["last_resolution"],
+        }))
+
+    gaps = pd.concat([gaps] + edges, ignore_index=True)
+    if start is not None:
+        gaps = gaps[gaps["gap_end"] > start]  # buchi nel margine letto prima della finestra
+    if gaps.empty:
+        return pd.DataFrame(columns=columns)
+
+    gaps["resolution_minutes"] = (gaps["resolution"].dt.total_seconds() // 60).astype(int)
+    gaps["missing_intervals"] = np.ceil((gaps["gap_end"] - gaps["gap_start"]) / gaps["resolution"]).astype(int)
+    return gaps[columns].sort_values(KEY_COLS + ["gap_start"]).reset_index(drop=True)
+
+def read_series_timestamps(conn, dataset, start=None, end=None):
+    # Solo la finestra richiesta (più un margine per la risoluzione locale), non tutto lo storico
+    params = {"start": to_utc(start) - READ_MARGIN if start is not None else None,
+              "end": to_utc(end) if end is not None else None}
+    with conn.cursor() as cursor:
+        cursor.execute(SERIES_QUERIES[dataset], params)
+        rows = cursor.fetchall()
+    return pd.DataFrame(rows, columns=KEY_COLS + ["timestamp"])
+
+# ------------------------------
+# Aggiornamento indice
+# ------------------------------
+def refresh_gap_index(conn, datasets=None, start=None, end=None):
+    ensure_gap_table(conn)
+    datasets = datasets or list(SERIES_QUERIES)
+    run_ts = datetime.now(pytz.UTC)
+    summary = {}
+
+    for dataset in datasets:
+        gaps = detect_gaps(read_series_timestamps(conn, dataset, start, end), start=start, end=end)
+        values = [
+            (dataset, g.key_1, g.key_2, g.gap_start.to_pydatetime(), g.gap_end.to_pydatetime(),
+             int(g.resolution_minutes), int(g.missing_intervals), run_ts)
+            for g in gaps.itertuples(index=False)
+        ]
+        with conn.cursor() as cursor:
+            try:
+                if values:
+                    # Upsert: i buchi già noti mantengono il contatore dei tentativi
+                    execute_values(cursor, """
+                        INSERT INTO data_gaps(dataset, key_1, key_2, gap_start, gap_end,
+                                              resolution_minutes, missing_intervals, detected_at)
+                        VALUES %s
+                        ON CONFLICT (dataset, key_1, key_2, gap_start) DO UPDATE
+                        SET gap_end = EXCLUDED.gap_end,
+                            resolution_minutes = EXCLUDED.resolution_minutes,
+                            missing_intervals = EXCLUDED.missing_intervals,
+                            detected_at = EXCLUDED.detected_at;
+                    """, values)
+                # I buchi della finestra non più rilevati sono stati colmati
+                cursor.execute("""
+                    DELETE FROM data_gaps
+                    WHERE dataset = %(dataset)s AND detected_at < %(run_ts)s
+                      AND (%(start)s::timestamptz IS NULL OR gap_end > %(start)s)
+                      AND (%(end)s::timestamptz IS NULL OR gap_start < %(end)s);
+                """, {"dataset": dataset, "run_ts": run_ts,
+                      "start": to_utc(start) if start is not None else None,
+                      "end": to_utc(end) if end is not None else None})
+            except Exception as e:
+                logging.error(f"Errore aggiornamento indice buchi {dataset}: {e}")
+                conn.rollback()
+                continue
+        conn.commit()
+        summary[dataset] = len(values)
+        logging.info(f"Indice buchi {dataset}: {len(values)} intervalli mancanti")
+
+    return summary
+
+def load_gaps(conn, datasets=None, max_attempts=MAX_ATTEMPTS, start=None, end=None):
+    # start/end: solo i buchi che intersecano la finestra (quella appena reindicizzata)
+    datasets = datasets or list(SERIES_QUERIES)
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT dataset, key_1, key_2, gap_start, gap_end, resolution_minutes, missing_intervals, attempts
+            FROM data_gaps
+            WHERE dataset = ANY(%(datasets)s) AND attempts < %(max_attempts)s
+              AND (%(start)s::timestamptz IS NULL OR gap_end > %(start)s)
+              AND (%(end)s::timestamptz IS NULL OR gap_start < %(end)s)
+            ORDER BY dataset, key_1, key_2, gap_start;
+        """, {"datasets": list(datasets), "max_attempts": max_attempts, "start": start, "end": end})
+        rows = cursor.fetchall()
+    gaps = pd.DataFrame(rows, columns=[
+        "dataset", "key_1", "key_2", "gap_start", "gap_end", "resolution_minutes", "missing_intervals", "attempts"
+    ])
+    for col in ["gap_start", "gap_end"]:
+        gaps[col] = pd.to_datetime(gaps[col], utc=True)
+    return gaps
+
+def mark_attempts(conn, dataset, gaps):
+    values = [(dataset, g.key_1, g.key_2, g.gap_start.to_pydatetime()) for g in gaps.itertuples(index=False)]
+    if not values:
+        return
+    with conn.cursor() as cursor:
+        execute_values(cursor, """
+            UPDATE data_gaps AS d SET attempts = d.attempts + 1
+            FROM (VALUES %s) AS v(dataset, key_1, key_2, gap_start)
+            WHERE d.dataset = v.dataset AND d.key_1 = v.key_1 AND d.key_2 = v.key_2
+              AND d.gap_start = v.gap_start::timestamptz;
+        """, values)
+    conn.commit()
+
+def merge_intervals(gaps, freq="h"):
+    # Unisce i buchi sovrapposti/contigui di una stessa chiamata API,
+    # allineando gli estremi all'ora (granularità minima delle richieste ENTSO-E)
+    if gaps.empty:
+        return []
+    spans = sorted(zip(gaps["gap_start"].dt.floor(freq), gaps["gap_end"].dt.ceil(freq)))
+    merged = [list(spans[0])]
+    for s, e in spans[1:]:
+        if s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return [(s, e) for s, e in merged]
+
+def in_gaps(index, gaps):
+    # Maschera booleana dei timestamp che cadono in almeno un buco [gap_start, gap_end)
+    index = pd.DatetimeIndex(index).tz_convert("UTC")
+    mask = np.zeros(len(index), dtype=bool)
+    for g in gaps.itertuples(index=False):
+        mask |= (index >= g.gap_start) & (index < g.gap_end)
+    return mask
@@ -0,0 +1,252 @@
+import argparse
+import logging
+
+import pandas as pd
+
+from connect_local import get_connection
+from dirty_ranges import ensure_dirty_ranges_table
+
+# ------------------------------
+# Griglia oraria canonica
+# ------------------------------
+# ENTSO-E pubblica potenze medie (MW) a 15 minuti per alcune zone (es. DE) e
+# orarie per altre (es. FR): le tabelle grezze le conservano come arrivano.
+# Le tabelle *_hourly contengono l'energia di ogni ora (MWh = MW x durata
+# dell'intervallo nativo), così confronti tra paesi e aggregazioni leggono
+# una griglia uniforme e più piccola.
+HOURLY = {
+    "production": {
+        "raw": "production",
+        "table": "production_hourly",
+        "keys": ["country_code", "source_id"],
+        "countries": ["country_code"],
+        "value": "production_mwh",
+    },
+    "consumption": {
+        "raw": "consumption",
+        "table": "consumption_hourly",
+        "keys": ["country_code"],
+        "countries": ["country_code"],
+        "value": "consumption_mwh",
+    },
+    "flows": {
+        "raw": "crossborder_flows",
+        "table": "crossborder_flows_hourly",
+        "keys": ["from_country", "to_country"],
+        "countries": ["from_country", "to_country"],
+        "value": "flow_mwh",
+    },
+}
+
+# Risoluzioni pubblicate da ENTSO-E (PT15M, PT30M, PT60M)
+RESOLUTIONS = (15, 30, 60)
+DEFAULT_RESOLUTION = 60
+
+def create_hourly_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS series_resolution (
+            dataset TEXT NOT NULL,
+            key_1 TEXT NOT NULL,
+            key_2 TEXT NOT NULL DEFAULT '',
+            valid_from TIMESTAMPTZ NOT NULL,
+            valid_to TIMESTAMPTZ NOT NULL,
+            resolution_minutes INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (dataset, key_1, key_2, valid_from)
+        );
+        CREATE TABLE IF NOT EXISTS hourly_grid_state (
+            built_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS production_hourly (
+            country_code TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            timestamp TIMESTAMPTZ NOT NULL,
+            production_mwh DOUBLE PRECISION,
+            samples INTEGER NOT NULL,
+            resolution_minutes INTEGER NOT NULL,
+            PRIMARY KEY (country_code, source_id, timestamp)
+        );
+        CREATE TABLE IF NOT EXISTS consumption_hourly (
+            country_code TEXT NOT NULL,
+            timestamp TIMESTAMPTZ NOT NULL,
+            consumption_mwh DOUBLE PRECISION,
+            samples INTEGER NOT NULL,
+            resolution_minutes INTEGER NOT NULL,
+            PRIMARY KEY (country_code, timestamp)
+        );
+        CREATE TABLE IF NOT EXISTS crossborder_flows_hourly (
+            from_country TEXT NOT NULL,
+            to_country TEXT NOT NULL,
+            timestamp TIMESTAMPTZ NOT NULL,
+            flow_mwh DOUBLE PRECISION,
+            samples INTEGER NOT NULL,
+            resolution_minutes INTEGER NOT NULL,
+            PRIMARY KEY (from_country, to_country, timestamp)
+        );
+    """)
+
+def grid_built(cursor):
+    # Marker scritto da rebuild_hourly: finché manca, le tabelle *_hourly coprono solo
+    # le ore scritte dopo il deploy e i lettori usano le tabelle grezze
+    cursor.execute("SELECT to_regclass('hourly_grid_state') IS NOT NULL;")
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM hourly_grid_state);")
+    return cursor.fetchone()[0]
+
+def ensure_hourly_tables(conn):
+    with conn.cursor() as cursor:
+        create_hourly_tables(cursor)
+        built = grid_built(cursor)
+    conn.commit()
+    # Primo avvio con la griglia oraria: si costruisce dallo storico già presente
+    if not built:
+        rebuild_hourly(conn)
+
+# ------------------------------
+# Risoluzione dichiarata
+# ------------------------------
+# Quando la sorgente dichiara la risoluzione (ResolutionCode dei file ENTSO-E) la si
+# registra per il periodo caricato; altrimenti ogni riga prende la durata dal passo
+# verso il punto successivo (o precedente) della stessa serie.
+def series_key(dataset, key_values):
+    key = [str(key_values[k]) for k in HOURLY[dataset]["keys"]]
+    return (key + [""])[:2]
+
+def record_resolution(cursor, dataset, key_values, timestamps, minutes):
+    if minutes not in RESOLUTIONS or not timestamps:
+        return
+    index = pd.DatetimeIndex(list(timestamps))
+    key_1, key_2 = series_key(dataset, key_values)
+    params = {
+        "dataset": dataset, "key_1": key_1, "key_2": key_2, "minutes": minutes,
+        "valid_from": index.min().to_pydatetime(),
+        "valid_to": (index.max() + pd.Timedelta(minutes=minutes)).to_pydatetime(),
+    }
+    # Periodo adiacente o sovrapposto con la stessa risoluzione: viene esteso
+    cursor.execute("""
+        UPDATE series_resolution
+        SET valid_from = LEAST(valid_from, %(valid_from)s), valid_to = GREATEST(valid_to, %(valid_to)s),
+            updated_at = now()
+        WHERE dataset = %(dataset)s AND key_1 = %(key_1)s AND key_2 = %(key_2)s
+          AND resolution_minutes = %(minutes)s
+          AND valid_from <= %(valid_to)s AND valid_to >= %(valid_from)s;
+    """, params)
+    if cursor.rowcount == 0:
+        cursor.execute("""
+            INSERT INTO series_resolution (dataset, key_1, key_2, valid_from, valid_to, resolution_minutes)
+            VALUES (%(dataset)s, %(key_1)s, %(key_2)s, %(valid_from)s, %(valid_to)s, %(minutes)s)
+            ON CONFLICT (dataset, key_1, key_2, valid_from) DO UPDATE
+            SET valid_to = EXCLUDED.valid_to, resolution_minutes = EXCLUDED.resolution_minutes, updated_at = now();
+        """, params)
+
+# ------------------------------
+# Materializzazione oraria
+# ------------------------------
+def hourly_query(dataset, key_values):
+    spec = HOURLY[dataset]
+    keys = ", ".join(spec["keys"])
+    t_keys = ", ".join(f"t.{k}" for k in spec["keys"])
+    hour = "date_trunc('hour', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+    series_filter = "".join(f" AND t.{k} = %({k})s" for k in (key_values or {}))
+    key_1 = f"r.{spec['keys'][0]}::text"
+    key_2 = f"r.{spec['keys'][1]}::text" if len(spec["keys"]) > 1 else "''"
+    # Durata di ogni riga: risoluzione dichiarata per il periodo, altrimenti la risoluzione
+    # locale della serie, cioè il passo verso il punto successivo se quello dopo lo conferma
+    # (cambio di risoluzione), altrimenti il passo dal precedente confermato allo stesso modo,
+    # altrimenti il più piccolo dei due passi validi. Un buco (passo doppio isolato) non
+    # allunga la riga prima: resta visibile come ora con meno campioni, come in gap_index.
+    # Le righe a meno di due ore dai bordi servono solo per LEAD/LAG.
+    return f"""
+        WITH raw AS (
+            SELECT {t_keys}, t.timestamp, t.{spec['value']} AS value,
+                   EXTRACT(EPOCH FROM LEAD(t.timestamp) OVER w - t.timestamp) / 60 AS next_step,
+                   EXTRACT(EPOCH FROM t.timestamp - LAG(t.timestamp) OVER w) / 60 AS prev_step,
+                   EXTRACT(EPOCH FROM LEAD(t.timestamp, 2) OVER w - LEAD(t.timestamp) OVER w) / 60 AS next_step_2,
+                   EXTRACT(EPOCH FROM LAG(t.timestamp) OVER w - LAG(t.timestamp, 2) OVER w) / 60 AS prev_step_2
+            FROM {spec['raw']} t
+            WHERE (%(start)s::timestamptz IS NULL OR t.timestamp >= %(start)s::timestamptz - interval '2 hours')
+              AND (%(end)s::timestamptz IS NULL OR t.timestamp < %(end)s::timestamptz + interval '2 hours'){series_filter}
+            WINDOW w AS (PARTITION BY {t_keys} ORDER BY t.timestamp)
+        ), rows AS (
+            SELECT r.*, COALESCE(
+                       d.resolution_minutes,
+                       CASE WHEN r.next_step = r.next_step_2 AND r.next_step = ANY(%(resolutions)s) THEN r.next_step
+                            WHEN r.prev_step = r.prev_step_2 AND r.prev_step = ANY(%(resolutions)s) THEN r.prev_step END,
+                       LEAST(CASE WHEN r.next_step = ANY(%(resolutions)s) THEN r.next_step END,
+                             CASE WHEN r.prev_step = ANY(%(resolutions)s) THEN r.prev_step END),
+                       {DEFAULT_RESOLUTION})::int AS minutes
+            FROM raw r
+            LEFT JOIN LATERAL (
+                SELECT s.resolution_minutes
+                FROM series_resolution s
+                WHERE s.dataset = %(dataset)s AND s.key_1 = {key_1} AND s.key_2 = {key_2}
+                  AND r.timestamp >= s.valid_from AND r.timestamp < s.valid_to
+                ORDER BY s.updated_at DESC
+                LIMIT 1
+            ) d ON true
+            WHERE (%(start)s::timestamptz IS NULL OR r.timestamp >= %(start)s)
+              AND (%(end)s::timestamptz IS NULL OR r.timestamp < %(end)s)
+        )
+        INSERT INTO {spec['table']} AS h ({keys}, timestamp, {spec['value']}, samples, resolution_minutes)
+        SELECT {keys}, {hour}, SUM(value * minutes) / 60.0, COUNT(value), MIN(minutes)
+        FROM rows
+        GROUP BY {keys}, {hour}
+        ON CONFLICT ({keys}, timestamp) DO UPDATE
+        SET {spec['value']} = EXCLUDED.{spec['value']},
+            samples = EXCLUDED.samples,
+            resolution_minutes = EXCLUDED.resolution_minutes;
+    """
+
+def materialize_hourly(cursor, dataset, key_values, timestamps):
+    # Ricalcola dalle righe grezze le ore toccate e quelle vicine (un nuovo punto cambia la
+    # durata dei due precedenti e dei due successivi). Restituisce prima e ultima ora riscritte.
+    if not timestamps:
+        return []
+    index = pd.DatetimeIndex(list(timestamps))
+    start = index.min().floor("h") - pd.Timedelta(hours=2)
+    end = index.max().floor("h") + pd.Timedelta(hours=3)
+    cursor.execute(hourly_query(dataset, key_values), {
+        "dataset": dataset,
+        "resolutions": list(RESOLUTIONS),
+        "start": start.to_pydatetime(),
+        "end": end.to_pydatetime(),
+        **key_values,
+    })
+    return [start.to_pydatetime(), (end - pd.Timedelta(hours=1)).to_pydatetime()]
+
+def rebuild_hourly(conn):
+    # Primo avvio o dati caricati prima della griglia oraria: tutte le ore dallo storico.
+    # I giorni ricalcolati finiscono in dirty_ranges, così KPI e replica si riallineano al giro successivo
+    ensure_dirty_ranges_table(conn)
+    with conn.cursor() as cursor:
+        create_hourly_tables(cursor)
+        for dataset, spec in HOURLY.items():
+            cursor.execute(hourly_query(dataset, None), {
+                "dataset": dataset, "resolutions": list(RESOLUTIONS), "start": None, "end": None,
+            })
+            logging.info(f"Griglia oraria {spec['table']}: {cursor.rowcount} ore")
+            countries = " UNION ALL ".join(
+                f"SELECT {c} AS country_code, timestamp FROM {spec['table']}" for c in spec["countries"])
+            cursor.execute(f"""
+                INSERT INTO dirty_ranges(dataset, country_code, range_start, range_end)
+                SELECT %s, country_code, MIN(timestamp AT TIME ZONE 'UTC')::date, MAX(timestamp AT TIME ZONE 'UTC')::date
+                FROM ({countries}) c
+                GROUP BY country_code;
+            """, (dataset,))
+        cursor.execute("DELETE FROM hourly_grid_state; INSERT INTO hourly_grid_state(built_at) VALUES (now());")
+    conn.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Griglia oraria canonica")
+    parser.add_argument("--rebuild", action="store_true", help="ricalcola tutte le ore dallo storico")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    conn = get_connection()
+    if conn:
+        if args.rebuild:
+            rebuild_hourly(conn)
+        else:
+            ensure_hourly_tables(conn)
+        conn.close()
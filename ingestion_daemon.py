@@ -0,0 +1,179 @@
+import logging
+import os
+import queue
+import random
+import signal
+import threading
+import time
+
+import pandas as pd
+import requests
+
+import ingestion_entsoe as ingestion
+from connect_local import get_pool
+from dirty_ranges import ensure_dirty_ranges_table
+from hourly_grid import ensure_hourly_tables
+from stats_energy import update_kpis
+from replica_energy import REPLICA_DIR, refresh_replica
+from snapshot_energy import SNAPSHOT_DIR, build_snapshot
+
+# ------------------------------
+# Configurazione
+# ------------------------------
+# Cadenza (minuti) e finestra riletta a ogni run (ore) per dataset:
+# la finestra copre anche le revisioni recenti pubblicate dai TSO
+CADENCES = {
+    "load": {"every_min": int(os.getenv("LOAD_EVERY_MIN", 15)), "lookback_h": 6},
+    "generation": {"every_min": int(os.getenv("GENERATION_EVERY_MIN", 60)), "lookback_h": 24},
+    "flows": {"every_min": int(os.getenv("FLOWS_EVERY_MIN", 60)), "lookback_h": 24},
+    "gaps": {"every_min": int(os.getenv("GAPS_EVERY_MIN", 360)), "lookback_h": 24 * 30},
+    "kpis": {"every_min": int(os.getenv("KPIS_EVERY_MIN", 15)), "lookback_h": 0},
+    "replica": {"every_min": int(os.getenv("REPLICA_EVERY_MIN", 15)), "lookback_h": 0},
+    "snapshot": {"every_min": int(os.getenv("SNAPSHOT_EVERY_MIN", 60)), "lookback_h": 0},
+}
+JITTER_S = int(os.getenv("JITTER_S", 60))       # ritardo casuale per non colpire l'API tutti insieme
+WORKERS = int(os.getenv("DAEMON_WORKERS", 2))
+QUEUE_SIZE = int(os.getenv("DAEMON_QUEUE_SIZE", 8))
+
+# ------------------------------
+# Job
+# ------------------------------
+class Job:
+    def __init__(self, name, dataset, run):
+        self.name = name
+        self.dataset = dataset
+        self.run = run  # run(conn, client, start, end)
+        self.next_run = time.monotonic() + random.uniform(0, JITTER_S)
+
+    def window(self):
+        # Finestra che termina al quarto d'ora corrente
+        end = pd.Timestamp.now(tz="UTC").floor("15min")
+        return end - pd.Timedelta(hours=CADENCES[self.dataset]["lookback_h"]), end
+
+    def schedule_next(self):
+        self.next_run = time.monotonic() + CADENCES[self.dataset]["every_min"] * 60 + random.uniform(0, JITTER_S)
+
+def build_jobs():
+    jobs = []
+    for country in ingestion.countries:
+        jobs.append(Job(f"load:{country}", "load",
+                        lambda conn, client, s, e, c=country: ingestion.ingest_load(conn, client, c, s, e)))
+        jobs.append(Job(f"generation:{country}", "generation",
+                        lambda conn, client, s, e, c=country: ingestion.ingest_generation(conn, client, c, s, e)))
+    for from_c, to_c in ingestion.country_pairs:
+        jobs.append(Job(f"flows:{from_c}->{to_c}", "flows",
+                        lambda conn, client, s, e, f=from_c, t=to_c: ingestion.ingest_flows(conn, client, f, t, s, e)))
+    jobs.append(Job("gaps", "gaps", ingestion.repair_gaps))
+    jobs.append(Job("kpis", "kpis", lambda conn, client, s, e: update_kpis(conn)))
+    if REPLICA_DIR:
+        jobs.append(Job("replica", "replica", lambda conn, client, s, e: refresh_replica(conn)))
+    if SNAPSHOT_DIR:
+        jobs.append(Job("snapshot", "snapshot", lambda conn, client, s, e: build_snapshot(conn)))
+    return jobs
+
+# ------------------------------
+# Daemon
+# ------------------------------
+class IngestionDaemon:
+    def __init__(self, jobs, workers=WORKERS, queue_size=QUEUE_SIZE):
+        self.jobs = jobs
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.in_flight = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.local = threading.local()
+        self.pool = get_pool(minconn=1, maxconn=workers)
+        self.workers = [
+            threading.Thread(target=self.worker_loop, name=f"worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def client(self):
+        # Un client ENTSO-E per thread, con la sua Session HTTP tenuta calda tra i job
+        if not hasattr(self.local, "client"):
+            self.local.client = ingestion.get_client(session=requests.Session())
+        return self.local.client
+
+    def submit(self, job):
+        with self.lock:
+            if job.name in self.in_flight:
+                logging.warning(f"Job {job.name} ancora in esecuzione: run saltato")
+                return
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                logging.warning(f"Coda piena: job {job.name} saltato")
+                return
+            self.in_flight.add(job.name)
+
+    def worker_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                job = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.run_job(job)
+            finally:
+                with self.lock:
+                    self.in_flight.discard(job.name)
+                self.queue.task_done()
+
+    def run_job(self, job):
+        start, end = job.window()
+        conn = self.pool.getconn()
+        started = time.monotonic()
+        try:
+            result = job.run(conn, self.client(), start, end)
+            logging.info(f"Job {job.name} {start}->{end} completato in {time.monotonic() - started:.1f}s: {result}")
+        except Exception as e:
+            logging.error(f"Errore job {job.name} {start}->{end}: {e}")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        finally:
+            # Connessione rotta: il pool la chiude e ne apre una nuova al prossimo getconn
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def run(self):
+        if not self.pool:
+            logging.error(f"Impossibile connettersi al DB.")
+            return
+
+        conn = self.pool.getconn()
+        try:
+            ingestion.populate_countries(conn)
+            ensure_dirty_ranges_table(conn)
+            ensure_hourly_tables(conn)
+        finally:
+            self.pool.putconn(conn)
+
+        for worker in self.workers:
+            worker.start()
+        logging.info(f"Daemon avviato: {len(self.jobs)} job, {len(self.workers)} worker")
+
+        # Scheduler: accoda i job scaduti e dorme fino alla prossima scadenza
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    self.submit(job)
+                    job.schedule_next()
+            next_due = min(job.next_run for job in self.jobs)
+            self.stop_event.wait(max(0.0, min(next_due - time.monotonic(), 30)))
+
+        for worker in self.workers:
+            worker.join()
+        self.pool.closeall()
+        logging.info(f"Daemon arrestato")
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+if __name__ == "__main__":
+    ingestion.setup_logging(prefix="daemon")
+    daemon = IngestionDaemon(build_jobs())
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
@@ -7,34 +7,44 @@ import logging
 from psycopg2.extras import execute_values
 import os
 import logging
+import argparse
+from contextlib import contextmanager
+from gap_index import refresh_gap_index, load_gaps, mark_attempts, merge_intervals, in_gaps
+from dirty_ranges import ensure_dirty_ranges_table, mark_dirty_ranges
+from hourly_grid import ensure_hourly_tables, record_resolution, materialize_hourly
+from stats_energy import update_kpis
+from replica_energy import refresh_replica
+from snapshot_energy import build_snapshot
 
 
 # ------------------------------
 # Logging con cartella /logs
 # ------------------------------
 logs_dir = "logs"
-os.makedirs(logs_dir, exist_ok=True)  # crea la cartella se non esiste
 
-timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")  # timestamp UTC
+def setup_logging(prefix="import"):
+    os.makedirs(logs_dir, exist_ok=True)  # crea la cartella se non esiste
 
-date_str = datetime.utcnow().strftime("%Y%m%d")
-log_filename = os.path.join(logs_dir, f"import_{timestamp}.log")
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")  # timestamp UTC
+    log_filename = os.path.join(logs_dir, f"{prefix}_{timestamp}.log")
 
-logging.basicConfig(
-    level=logging.INFO,
-    filename=log_filename,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+    logging.basicConfig(
+        level=logging.INFO,
+        filename=log_filename,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
 
-logging.info(f"Inizio import dati")
 # ------------------------------
 # ENTSO-E API
 # ------------------------------
 API_KEY = os.getenv("API_KEY")
-client = EntsoePandasClient(api_key=API_KEY)
+
+def get_client(session=None):
+    # session: requests.Session da riusare tra le chiamate (connessioni HTTP keep-alive)
+    return EntsoePandasClient(api_key=API_KEY, session=session)
 
 # ------------------------------
-# Intervallo di interesse
+# Intervallo di interesse (default per l'import one-shot)
 # ------------------------------
 start = pd.Timestamp("2024-12-01T00:00Z")
 end = pd.Timestamp("2025-01-31T23:00Z")
@@ -44,6 +54,9 @@ end = pd.Timestamp("2025-01-31T23:00Z")
 # ------------------------------
 countries = ["FR", "DE"]
 
+# Cross-border flows solo FR <-> DE
+country_pairs = [("FR", "DE"), ("DE", "FR")]
+
 # ------------------------------
 # Helper per DB
 # ------------------------------
@@ -65,6 +78,7 @@ def populate_countries(conn):
     conn.commit()
 
 def populate_energy_sources(conn, df):
+    # Nessun commit: le fonti entrano nella transazione del chunk di produzione
     with conn.cursor() as cursor:
         for source in df.columns:
             # Se il nome della colonna è una tupla, prendi solo il primo elemento
@@ -72,18 +86,122 @@ def populate_energy_sources(conn, df):
                 source_str = source[0]
             else:
                 source_str = str(source)
-            try:
-                cursor.execute("""
-                    INSERT INTO energy_sources(source_name)
-                    VALUES (%s)
-                    ON CONFLICT (source_name) DO NOTHING;
-                """, (source_str,))
-            except Exception as e:
-                logging.error(f"Errore insert energy source {source_str}: {e}")
-                conn.rollback()
-    conn.commit()
+            cursor.execute("""
+                INSERT INTO energy_sources(source_name)
+                VALUES (%s)
+                ON CONFLICT (source_name) DO NOTHING;
+            """, (source_str,))
+
+# ------------------------------
+# Transazioni per chunk
+# ------------------------------
+# Una transazione per (dataset, chunk temporale), con un solo commit a fine chunk.
+# Ogni batch (una fonte o una serie) gira sotto un SAVEPOINT: se fallisce si torna
+# al savepoint e si riprova, senza perdere i batch già scritti nello stesso chunk.
+CHUNK_DAYS = int(os.getenv("CHUNK_DAYS", 7))
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", 1))
+
+def time_chunks(start, end, days=None):
+    step = pd.Timedelta(days=days or CHUNK_DAYS)
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + step, end)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end
+
+def run_batch(cursor, label, total, fn):
+    for attempt in range(BATCH_RETRIES + 1):
+        cursor.execute("SAVEPOINT batch;")
+        try:
+            result = fn()
+        except Exception as e:
+            # Annulla solo questo batch: il resto della transazione resta valido
+            cursor.execute("ROLLBACK TO SAVEPOINT batch;")
+            if attempt < BATCH_RETRIES:
+                total["retried"] += 1
+                logging.warning(f"Batch {label} fallito, nuovo tentativo: {e}")
+            else:
+                total["discarded"] += 1
+                logging.error(f"Batch {label} scartato dopo {attempt + 1} tentativi: {e}")
+        else:
+            cursor.execute("RELEASE SAVEPOINT batch;")
+            total["batches"] += 1
+            return result
+    return None
+
+@contextmanager
+def chunk_transaction(conn, label):
+    # Errore fuori dai savepoint (API, connessione): si annulla solo il chunk corrente
+    try:
+        yield
+        conn.commit()
+    except Exception:
+        logging.error(f"Chunk {label} annullato")
+        conn.rollback()
+        raise
+
+# ------------------------------
+# Scrittura change-aware
+# ------------------------------
+# insert: ON CONFLICT DO NOTHING (le revisioni TSO vengono ignorate)
+# upsert: aggiorna solo le righe il cui valore è realmente cambiato
+WRITE_MODE = os.getenv("WRITE_MODE", "upsert")
+
+def new_write_stats():
+    return {"inserted": 0, "updated": 0, "unchanged": 0, "batches": 0, "retried": 0, "discarded": 0,
+            "failed_chunks": 0}
+
+def add_write_stats(total, stats):
+    for k, v in stats.items():
+        total[k] += v
+    return total
+
+def upsert_values(cursor, table, key_cols, value_col, values, mode=None):
+    mode = mode or WRITE_MODE
+    cols = ", ".join(key_cols + [value_col])
+    keys = ", ".join(key_cols)
+    if mode == "insert":
+        sql = f"""
+            INSERT INTO {table} AS t ({cols})
+            VALUES %s
+            ON CONFLICT ({keys}) DO NOTHING
+            RETURNING t.timestamp, true;
+        """
+    else:
+        sql = f"""
+            INSERT INTO {table} AS t ({cols})
+            VALUES %s
+            ON CONFLICT ({keys}) DO UPDATE
+            SET {value_col} = EXCLUDED.{value_col}
+            WHERE t.{value_col} IS DISTINCT FROM EXCLUDED.{value_col}
+            RETURNING t.timestamp, (t.xmax = 0);
+        """
+    # RETURNING restituisce solo le righe inserite o aggiornate: le altre sono invariate
+    returned = execute_values(cursor, sql, values, fetch=True)
+    inserted = sum(1 for _, is_new in returned if is_new)
+    stats = {
+        "inserted": inserted,
+        "updated": len(returned) - inserted,
+        "unchanged": len(values) - len(returned),
+    }
+    return stats, [ts for ts, _ in returned]
+
+def get_source_id(cursor, source_str):
+    cursor.execute("SELECT source_id FROM energy_sources WHERE source_name=%s;", (source_str,))
+    res = cursor.fetchone()
+    if res:
+        return res[0]
+    cursor.execute(
+        "INSERT INTO energy_sources(source_name) VALUES(%s) RETURNING source_id;",
+        (source_str,)
+    )
+    return cursor.fetchone()[0]
 
-def insert_production(conn, country_code, df):
+# Gli insert_* non fanno commit: scrivono nella transazione del chunk aperta dal chiamante.
+# resolution_minutes: risoluzione dichiarata dalla sorgente (file), altrimenti dedotta riga per riga
+def insert_production(conn, country_code, df, total=None, resolution_minutes=None):
+    total = total if total is not None else new_write_stats()
+    seen = set()
     with conn.cursor() as cursor:
         for source_name in df.columns:
             # Prendi solo il primo elemento se è una tupla
@@ -91,142 +209,311 @@ def insert_production(conn, country_code, df):
                 source_str = source_name[0]
             else:
                 source_str = str(source_name)
-
-            try:
-                cursor.execute("SELECT source_id FROM energy_sources WHERE source_name=%s;", (source_str,))
-                res = cursor.fetchone()
-                if res:
-                    source_id = res[0]
-                else:
-                    cursor.execute(
-                        "INSERT INTO energy_sources(source_name) VALUES(%s) RETURNING source_id;",
-                        (source_str,)
-                    )
-                    source_id = cursor.fetchone()[0]
-            except Exception as e:
-                logging.error(f"Errore query/insert source {source_str}: {e}")
-                conn.rollback()
+            # Stessa fonte su più colonne (es. Actual Aggregated / Actual Consumption):
+            # vale la prima, altrimenti l'upsert alternerebbe i valori a ogni run
+            if source_str in seen:
                 continue
+            seen.add(source_str)
 
-            # Lista dei valori da inserire nella tabella production
-            values = []
+            # Valori da scrivere nella tabella production (un valore per timestamp)
+            points = {}
             for ts, value in df[source_name].items():
                 try:
                     ts_pd = pd.Timestamp(ts)
                     ts_utc = ts_pd.to_pydatetime().astimezone(pytz.UTC)
-                    mwh = float(value)
-                    values.append((country_code, source_id, ts_utc, mwh))
+                    points[ts_utc] = float(value)
                 except Exception as e:
                     logging.error(f"Errore preparazione production {country_code}, {source_str}, {ts}: {e}")
+            if not points:
+                continue
 
-            if values:
-                try:
-                    execute_values(cursor, """
-                        INSERT INTO production(country_code, source_id, timestamp, production_mwh)
-                        VALUES %s
-                        ON CONFLICT (country_code, source_id, timestamp) DO NOTHING;
-                    """, values)
-                except Exception as e:
-                    logging.error(f"Errore batch insert production {country_code}, {source_str}: {e}")
-                    conn.rollback()
-    conn.commit()
+            def write_source():
+                source_id = get_source_id(cursor, source_str)
+                values = [(country_code, source_id, ts, mwh) for ts, mwh in points.items()]
+                stats, changed = upsert_values(
+                    cursor, "production", ["country_code", "source_id", "timestamp"],
+                    "production_mwh", values
+                )
+                # Ore corrispondenti nella griglia oraria (con la risoluzione dichiarata, se nota)
+                key_values = {"country_code": country_code, "source_id": source_id}
+                record_resolution(cursor, "production", key_values, points.keys(), resolution_minutes)
+                hours = materialize_hourly(cursor, "production", key_values, changed)
+                mark_dirty_ranges(cursor, "production", [country_code], changed + hours)
+                return stats
 
-def insert_consumption(conn, country_code, series):
+            stats = run_batch(cursor, f"production {country_code}, {source_str}", total, write_source)
+            if stats:
+                add_write_stats(total, stats)
+                logging.info(f"Production {country_code}, {source_str}: {stats}")
+    return total
+
+def insert_consumption(conn, country_code, series, total=None, resolution_minutes=None):
+    total = total if total is not None else new_write_stats()
     if isinstance(series, pd.DataFrame):
         series = series['Actual Load'] if 'Actual Load' in series.columns else series.iloc[:, 0]
 
-    values = []
+    values = {}
     for ts, value in series.items():
         try:
             ts_pd = pd.to_datetime(ts)
             ts_utc = ts_pd.to_pydatetime().astimezone(pytz.UTC)
             mwh = float(value)
-            values.append((country_code, ts_utc, mwh))
+            values[ts_utc] = (country_code, ts_utc, mwh)
         except Exception as e:
             logging.error(f"Errore preparazione consumption {country_code}, {ts}: {e}")
 
     if values:
         with conn.cursor() as cursor:
-            try:
-                execute_values(cursor, """
-                    INSERT INTO consumption(country_code, timestamp, consumption_mwh)
-                    VALUES %s
-                    ON CONFLICT (country_code, timestamp) DO NOTHING;
-                """, values)
-            except Exception as e:
-                logging.error(f"Errore batch insert consumption {country_code}: {e}")
-                conn.rollback()
-        conn.commit()
+            def write_series():
+                stats, changed = upsert_values(
+                    cursor, "consumption", ["country_code", "timestamp"],
+                    "consumption_mwh", list(values.values())
+                )
+                key_values = {"country_code": country_code}
+                record_resolution(cursor, "consumption", key_values, values.keys(), resolution_minutes)
+                hours = materialize_hourly(cursor, "consumption", key_values, changed)
+                mark_dirty_ranges(cursor, "consumption", [country_code], changed + hours)
+                return stats
+
+            stats = run_batch(cursor, f"consumption {country_code}", total, write_series)
+            if stats:
+                add_write_stats(total, stats)
+                logging.info(f"Consumption {country_code}: {stats}")
+    return total
 
-def insert_flows(conn, from_country, to_country, series):
-    values = []
+def insert_flows(conn, from_country, to_country, series, total=None, resolution_minutes=None):
+    total = total if total is not None else new_write_stats()
+    values = {}
     for ts, value in series.items():
         try:
             ts_pd = pd.Timestamp(ts)
             ts_utc = ts_pd.to_pydatetime().astimezone(pytz.UTC)
             mwh = float(value)
-            values.append((from_country, to_country, ts_utc, mwh))
+            values[ts_utc] = (from_country, to_country, ts_utc, mwh)
         except Exception as e:
             logging.error(f"Errore preparazione flow {from_country}->{to_country}, {ts}: {e}")
 
     if values:
         with conn.cursor() as cursor:
+            def write_series():
+                stats, changed = upsert_values(
+                    cursor, "crossborder_flows", ["from_country", "to_country", "timestamp"],
+                    "flow_mwh", list(values.values())
+                )
+                key_values = {"from_country": from_country, "to_country": to_country}
+                record_resolution(cursor, "flows", key_values, values.keys(), resolution_minutes)
+                hours = materialize_hourly(cursor, "flows", key_values, changed)
+                # Un flusso modifica il saldo di entrambi i paesi
+                mark_dirty_ranges(cursor, "flows", [from_country, to_country], changed + hours)
+                return stats
+
+            stats = run_batch(cursor, f"flow {from_country}->{to_country}", total, write_series)
+            if stats:
+                add_write_stats(total, stats)
+                logging.info(f"Flow {from_country}->{to_country}: {stats}")
+    return total
+
+# ------------------------------
+# Re-fetch mirato dei buchi
+# ------------------------------
+def source_label(column):
+    return column[0] if isinstance(column, tuple) else str(column)
+
+def repair_gaps(conn, client, window_start=start, window_end=end):
+    refresh_gap_index(conn, start=window_start, end=window_end)
+    # Solo i buchi della finestra: quelli fuori non verrebbero ripuliti dal refresh finale
+    gaps = load_gaps(conn, start=window_start, end=window_end)
+    if gaps.empty:
+        logging.info("Nessun buco da colmare.")
+        return {"gaps": 0, "api_calls": 0, "rows": 0}
+
+    api_calls = 0
+    rows = 0
+    total = new_write_stats()
+
+    # Production: una chiamata per paese e intervallo, poi solo le fonti/timestamp mancanti
+    prod_gaps = gaps[gaps['dataset'] == 'production']
+    for country, country_gaps in prod_gaps.groupby('key_1'):
+        sources = set(country_gaps['key_2'])
+        for gap_start, gap_end in merge_intervals(country_gaps):
             try:
-                execute_values(cursor, """
-                    INSERT INTO crossborder_flows(from_country, to_country, timestamp, flow_mwh)
-                    VALUES %s
-                    ON CONFLICT (from_country, to_country, timestamp) DO NOTHING;
-                """, values)
+                with chunk_transaction(conn, f"production {country} {gap_start}->{gap_end}"):
+                    prod_df = client.query_generation(country, start=gap_start, end=gap_end)
+                    api_calls += 1
+                    if prod_df.empty:
+                        continue
+                    prod_df = prod_df[[c for c in prod_df.columns if source_label(c) in sources]]
+                    prod_df = prod_df[in_gaps(prod_df.index, country_gaps)]
+                    if not prod_df.empty:
+                        insert_production(conn, country, prod_df, total)
+                        rows += int(prod_df.count().sum())
             except Exception as e:
-                logging.error(f"Errore batch insert flow {from_country}->{to_country}: {e}")
-                conn.rollback()
-        conn.commit()
+                logging.error(f"Errore re-fetch produzione {country} {gap_start}->{gap_end}: {e}")
+        mark_attempts(conn, 'production', country_gaps)
+
+    # Consumption
+    cons_gaps = gaps[gaps['dataset'] == 'consumption']
+    for country, country_gaps in cons_gaps.groupby('key_1'):
+        for gap_start, gap_end in merge_intervals(country_gaps):
+            try:
+                with chunk_transaction(conn, f"consumption {country} {gap_start}->{gap_end}"):
+                    cons_series = client.query_load(country, start=gap_start, end=gap_end)
+                    api_calls += 1
+                    if cons_series.empty:
+                        continue
+                    cons_series = cons_series[in_gaps(cons_series.index, country_gaps)]
+                    if not cons_series.empty:
+                        insert_consumption(conn, country, cons_series, total)
+                        rows += len(cons_series)
+            except Exception as e:
+                logging.error(f"Errore re-fetch consumo {country} {gap_start}->{gap_end}: {e}")
+        mark_attempts(conn, 'consumption', country_gaps)
+
+    # Cross-border flows
+    flow_gaps = gaps[gaps['dataset'] == 'flows']
+    for (from_c, to_c), pair_gaps in flow_gaps.groupby(['key_1', 'key_2']):
+        for gap_start, gap_end in merge_intervals(pair_gaps):
+            try:
+                with chunk_transaction(conn, f"flows {from_c}->{to_c} {gap_start}->{gap_end}"):
+                    flow_series = client.query_crossborder_flows(from_c, to_c, start=gap_start, end=gap_end)
+                    api_calls += 1
+                    if flow_series.empty:
+                        continue
+                    flow_series = flow_series[in_gaps(flow_series.index, pair_gaps)]
+                    if not flow_series.empty:
+                        insert_flows(conn, from_c, to_c, flow_series, total)
+                        rows += len(flow_series)
+            except Exception as e:
+                logging.error(f"Errore re-fetch flussi {from_c}->{to_c} {gap_start}->{gap_end}: {e}")
+        mark_attempts(conn, 'flows', pair_gaps)
+
+    logging.info(f"Re-fetch buchi: {len(gaps)} intervalli, {api_calls} chiamate API, {rows} righe richieste, "
+                 f"batch ritentati {total['retried']}, scartati {total['discarded']}")
+    refresh_gap_index(conn, start=window_start, end=window_end)
+    return {"gaps": len(gaps), "api_calls": api_calls, "rows": rows,
+            "retried": total["retried"], "discarded": total["discarded"]}
+
+# ------------------------------
+# Job per dataset (usati dall'import one-shot e dal daemon)
+# ------------------------------
+# Un chunk = una chiamata API + la sua scrittura + un commit.
+# Un chunk fallito (API, connessione) viene annullato e contato in failed_chunks;
+# i chunk successivi proseguono e il gap index segnalerà il periodo mancante.
+def ingest_generation(conn, client, country, start, end):
+    total = new_write_stats()
+    for chunk_start, chunk_end in time_chunks(start, end):
+        try:
+            with chunk_transaction(conn, f"production {country} {chunk_start}->{chunk_end}"):
+                prod_df = client.query_generation(country, start=chunk_start, end=chunk_end)
+                if prod_df.empty:
+                    continue
+                populate_energy_sources(conn, prod_df)
+                insert_production(conn, country, prod_df, total)
+        except Exception as e:
+            logging.error(f"Errore chunk production {country} {chunk_start}->{chunk_end}: {e}")
+            total["failed_chunks"] += 1
+    return total
+
+def ingest_load(conn, client, country, start, end):
+    total = new_write_stats()
+    for chunk_start, chunk_end in time_chunks(start, end):
+        try:
+            with chunk_transaction(conn, f"consumption {country} {chunk_start}->{chunk_end}"):
+                cons_series = client.query_load(country, start=chunk_start, end=chunk_end)
+                if cons_series.empty:
+                    continue
+                insert_consumption(conn, country, cons_series, total)
+        except Exception as e:
+            logging.error(f"Errore chunk consumption {country} {chunk_start}->{chunk_end}: {e}")
+            total["failed_chunks"] += 1
+    return total
+
+def ingest_flows(conn, client, from_c, to_c, start, end):
+    total = new_write_stats()
+    for chunk_start, chunk_end in time_chunks(start, end):
+        try:
+            with chunk_transaction(conn, f"flows {from_c}->{to_c} {chunk_start}->{chunk_end}"):
+                flow_series = client.query_crossborder_flows(from_c, to_c, start=chunk_start, end=chunk_end)
+                if flow_series.empty:
+                    continue
+                insert_flows(conn, from_c, to_c, flow_series, total)
+        except Exception as e:
+            logging.error(f"Errore chunk flows {from_c}->{to_c} {chunk_start}->{chunk_end}: {e}")
+            total["failed_chunks"] += 1
+    return total
 
 # ------------------------------
 # Main
 # ------------------------------
-def main():
+def main(mode="full"):
+    logging.info(f"Inizio import dati")
     conn = get_connection()
     if not conn:
         logging.error(f"Impossibile connettersi al DB.")
         return
 
+    client = get_client()
+    ensure_dirty_ranges_table(conn)
+    ensure_hourly_tables(conn)
+
+    if mode == "gaps":
+        repair_gaps(conn, client)
+        update_kpis(conn)
+        refresh_replica(conn)
+        build_snapshot(conn)
+        conn.close()
+        logging.info(f"Re-fetch buchi completato!")
+        return
+
     populate_countries(conn)
+    totals = {"production": new_write_stats(), "consumption": new_write_stats(), "flows": new_write_stats()}
 
     for country in countries:
         logging.info(f"Scaricando dati per {country}...")
 
         # Production
         try:
-            prod_df = client.query_generation(country, start=start, end=end)
-            if not prod_df.empty:
-                populate_energy_sources(conn, prod_df)
-                insert_production(conn, country, prod_df)
+            add_write_stats(totals["production"], ingest_generation(conn, client, country, start, end))
         except Exception as e:
             logging.error(f"Errore produzione {country}: {e}")
-            conn.rollback()
 
         # Consumption
         try:
-            cons_series = client.query_load(country, start=start, end=end)
-            if not cons_series.empty:
-                insert_consumption(conn, country, cons_series)
+            add_write_stats(totals["consumption"], ingest_load(conn, client, country, start, end))
         except Exception as e:
             logging.error(f"Errore consumo {country}: {e}")
-            conn.rollback()
 
-    # Cross-border flows solo FR <-> DE
-    country_pairs = [("FR", "DE"), ("DE", "FR")]
     for from_c, to_c in country_pairs:
         try:
-            flow_series = client.query_crossborder_flows(from_c, to_c, start=start, end=end)
-            if not flow_series.empty:
-                insert_flows(conn, from_c, to_c, flow_series)
+            add_write_stats(totals["flows"], ingest_flows(conn, client, from_c, to_c, start, end))
         except Exception as e:
             logging.error(f"Errore flussi {from_c}->{to_c}: {e}")
-            conn.rollback()
+
+    # batches/retried/discarded: esito dei savepoint per batch; failed_chunks: chunk annullati
+    for dataset, stats in totals.items():
+        logging.info(f"Totale {dataset}: {stats}")
+
+    # Indice dei buchi aggiornato a fine import
+    refresh_gap_index(conn, start=start, end=end)
+
+    # KPI aggiornati solo sui giorni toccati da questo import
+    update_kpis(conn)
+
+    # Replica Parquet/DuckDB per le dashboard (solo se REPLICA_DIR è impostata)
+    refresh_replica(conn)
+
+    # Snapshot Arrow per l'avvio rapido delle dashboard (solo se SNAPSHOT_DIR è impostata)
+    build_snapshot(conn)
 
     conn.close()
     logging.info(f"Import completato!")
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Import dati ENTSO-E")
+    parser.add_argument("--mode", choices=["full", "gaps"], default="full",
+                        help="full: intera finestra; gaps: solo gli intervalli mancanti")
+    parser.add_argument("--write-mode", choices=["insert", "upsert"], default=WRITE_MODE,
+                        help="insert: ignora le revisioni; upsert: aggiorna solo i valori cambiati")
+    args = parser.parse_args()
+    WRITE_MODE = args.write_mode
+    setup_logging()
+    main(args.mode)
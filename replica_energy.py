@@ -0,0 +1,262 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from connect_local import get_connection
+from dirty_ranges import ensure_dirty_ranges_table, load_dirty_ranges, snapshot_xmin, set_watermark
+from hourly_grid import ensure_hourly_tables
+
+# ------------------------------
+# Replica analitica locale (Parquet + DuckDB)
+# ------------------------------
+# Layout: REPLICA_DIR/<tabella>/<paese>/<YYYY-MM>/data.parquet
+# Ogni partizione viene riscritta per intero (e sostituita in modo atomico)
+# quando dirty_ranges segnala un cambiamento nel suo mese.
+REPLICA_DIR = os.getenv("REPLICA_DIR")
+READ_BACKEND = os.getenv("READ_BACKEND", "postgres")  # postgres | duckdb
+
+TABLES = {
+    "consumption": {
+        "dataset": "consumption",
+        "partition_col": "country_code",
+        "columns": [("country_code", "string"), ("timestamp", "timestamp"), ("consumption_mwh", "float")],
+    },
+    "production": {
+        "dataset": "production",
+        "partition_col": "country_code",
+        "columns": [("country_code", "string"), ("source_id", "int"),
+                    ("timestamp", "timestamp"), ("production_mwh", "float")],
+    },
+    "crossborder_flows": {
+        "dataset": "flows",
+        "partition_col": "from_country",
+        "columns": [("from_country", "string"), ("to_country", "string"),
+                    ("timestamp", "timestamp"), ("flow_mwh", "float")],
+    },
+    # Griglia oraria: stessi dataset in dirty_ranges delle tabelle grezze
+    "consumption_hourly": {
+        "dataset": "consumption",
+        "partition_col": "country_code",
+        "columns": [("country_code", "string"), ("timestamp", "timestamp"), ("consumption_mwh", "float"),
+                    ("samples", "int"), ("resolution_minutes", "int")],
+    },
+    "production_hourly": {
+        "dataset": "production",
+        "partition_col": "country_code",
+        "columns": [("country_code", "string"), ("source_id", "int"), ("timestamp", "timestamp"),
+                    ("production_mwh", "float"), ("samples", "int"), ("resolution_minutes", "int")],
+    },
+    "crossborder_flows_hourly": {
+        "dataset": "flows",
+        "partition_col": "from_country",
+        "columns": [("from_country", "string"), ("to_country", "string"), ("timestamp", "timestamp"),
+                    ("flow_mwh", "float"), ("samples", "int"), ("resolution_minutes", "int")],
+    },
+}
+# Tabelle piccole copiate per intero a ogni refresh (lette dalle dashboard a ogni layout)
+SMALL_TABLES = {
+    "energy_sources": [("source_id", "int"), ("source_name", "string")],
+    "hourly_grid_state": [("built_at", "timestamp")],
+    "kpi_rolling": [("country_code", "string"), ("as_of", "date"), ("avg_7d", "float"), ("avg_30d", "float"),
+                    ("avg_365d", "float"), ("peak_load_mw", "float"), ("load_factor", "float"),
+                    ("renewable_share", "float"), ("yoy_delta_pct", "float"), ("updated_at", "timestamp")],
+}
+
+def arrow_schema(columns):
+    import pyarrow as pa
+    types = {"string": pa.string(), "timestamp": pa.timestamp("us", tz="UTC"),
+             "float": pa.float64(), "int": pa.int64(), "date": pa.date32()}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+# ------------------------------
+# Scrittura partizioni
+# ------------------------------
+def write_parquet(path, rows, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    schema = arrow_schema(columns)
+    data = [list(col) for col in zip(*rows)] if rows else [[] for _ in columns]
+    tmp_path = f"{path}.tmp"
+    pq.write_table(pa.table(data, schema=schema), tmp_path, compression="zstd")
+    os.replace(tmp_path, path)  # i lettori vedono sempre un file completo
+
+def month_bounds(month):
+    month_start = datetime.strptime(month, "%Y-%m").replace(tzinfo=pytz.UTC)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    return month_start, next_month
+
+def months_between(range_start, range_end):
+    months = []
+    current = date(range_start.year, range_start.month, 1)
+    while current <= range_end:
+        months.append(current.strftime("%Y-%m"))
+        current = (current + timedelta(days=32)).replace(day=1)
+    return months
+
+def rewrite_partition(cursor, replica_dir, table, key, month):
+    spec = TABLES[table]
+    cols = ", ".join(name for name, _ in spec["columns"])
+    month_start, next_month = month_bounds(month)
+    cursor.execute(f"""
+        SELECT {cols}
+        FROM {table}
+        WHERE {spec['partition_col']} = %s AND timestamp >= %s AND timestamp < %s
+        ORDER BY timestamp;
+    """, (key, month_start, next_month))
+    rows = cursor.fetchall()
+
+    path = os.path.join(replica_dir, table, key, month, "data.parquet")
+    if rows:
+        write_parquet(path, rows, spec["columns"])
+    elif os.path.isdir(os.path.dirname(path)):
+        shutil.rmtree(os.path.dirname(path))
+    return len(rows)
+
+def rewrite_small_tables(cursor, replica_dir):
+    for table, columns in SMALL_TABLES.items():
+        # kpi_rolling esiste solo dopo il primo update_kpis: nessun file, le letture vanno su PostgreSQL
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        if not cursor.fetchone()[0]:
+            continue
+        cursor.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table};")
+        write_parquet(os.path.join(replica_dir, table, "data.parquet"), cursor.fetchall(), columns)
+
+# ------------------------------
+# Refresh incrementale
+# ------------------------------
+def state_path(replica_dir):
+    return os.path.join(replica_dir, "_state.json")
+
+def load_state(replica_dir):
+    try:
+        with open(state_path(replica_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_state(replica_dir, state):
+    tmp_path = f"{state_path(replica_dir)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path(replica_dir))
+
+def all_partitions(cursor, table):
+    spec = TABLES[table]
+    cursor.execute(f"""
+        SELECT DISTINCT {spec['partition_col']}, to_char(timestamp AT TIME ZONE 'UTC', 'YYYY-MM')
+        FROM {table};
+    """)
+    return set(cursor.fetchall())
+
+def dirty_partitions(ranges, table):
+    # flows: il range è segnato per entrambi i paesi, quindi anche per from_country
+    spec = TABLES[table]
+    partitions = set()
+    for r in ranges[ranges["dataset"] == spec["dataset"]].itertuples(index=False):
+        for month in months_between(r.range_start, r.range_end):
+            partitions.add((r.country_code, month))
+    return partitions
+
+def refresh_replica(conn, replica_dir=None, full=False):
+    replica_dir = replica_dir or REPLICA_DIR
+    if not replica_dir:
+        logging.info("REPLICA_DIR non impostata: replica non aggiornata")
+        return {}
+
+    ensure_dirty_ranges_table(conn)
+    ensure_hourly_tables(conn)
+    os.makedirs(replica_dir, exist_ok=True)
+    state = None if full else load_state(replica_dir)
+    # Stato delle versioni precedenti (watermark su range_id): ricostruzione completa
+    if state and "last_tx" not in state:
+        state = None
+
+    summary = {}
+    with conn.cursor() as cursor:
+        # Watermark = xmin dello snapshot, preso prima di leggere le partizioni: le transazioni
+        # ancora aperte hanno tx_id >= xmin e i loro intervalli verranno letti al giro successivo
+        if state:
+            ranges, upto_tx = load_dirty_ranges(conn, after_tx=state["last_tx"])
+        else:
+            ranges, upto_tx = None, snapshot_xmin(cursor)
+
+        for table in TABLES:
+            partitions = all_partitions(cursor, table) if state is None else dirty_partitions(ranges, table)
+            rows = 0
+            for key, month in sorted(partitions):
+                rows += rewrite_partition(cursor, replica_dir, table, key, month)
+            summary[table] = {"partitions": len(partitions), "rows": rows}
+        rewrite_small_tables(cursor, replica_dir)
+    conn.rollback()  # solo letture
+
+    save_state(replica_dir, {"last_tx": upto_tx, "refreshed_at": datetime.now(pytz.UTC).isoformat()})
+    # Watermark anche nel DB (una riga per host e cartella): dirty_ranges viene ripulita
+    # solo dopo che tutte le repliche hanno letto le righe
+    with conn.cursor() as cursor:
+        set_watermark(cursor, f"replica:{socket.gethostname()}:{os.path.abspath(replica_dir)}", upto_tx)
+    conn.commit()
+    logging.info(f"Replica aggiornata ({'completa' if state is None else 'incrementale'}): {summary}")
+    return summary
+
+# ------------------------------
+# Lettura tramite DuckDB
+# ------------------------------
+_duck = None
+_duck_views = set()
+_duck_lock = threading.Lock()
+
+def _table_glob(replica_dir, table):
+    if table in SMALL_TABLES:
+        return os.path.join(replica_dir, table, "data.parquet")
+    return os.path.join(replica_dir, table, "*", "*", "data.parquet")
+
+def _duck_connection(replica_dir):
+    global _duck
+    import duckdb
+
+    with _duck_lock:
+        if _duck is None:
+            _duck = duckdb.connect()
+            _duck.execute("SET TimeZone = 'UTC';")
+        # Vista sui file Parquet appena esistono. Finché una tabella non ha file la vista
+        # manca e la query fallisce: il fetch_df delle dashboard legge allora da PostgreSQL
+        for table in list(TABLES) + list(SMALL_TABLES):
+            if table in _duck_views:
+                continue
+            pattern = _table_glob(replica_dir, table)
+            if glob.glob(pattern):
+                _duck.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM read_parquet('{pattern}');")
+                _duck_views.add(table)
+        # Un cursore per chiamata: la connessione DuckDB non va condivisa tra thread
+        return _duck.cursor()
+
+def read_df(query, replica_dir=None):
+    replica_dir = replica_dir or REPLICA_DIR
+    if not replica_dir:
+        raise RuntimeError("REPLICA_DIR non impostata")
+    cursor = _duck_connection(replica_dir)
+    try:
+        return cursor.execute(query).df()
+    finally:
+        cursor.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggiornamento replica Parquet/DuckDB")
+    parser.add_argument("--full", action="store_true", help="ricostruisce tutte le partizioni")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    conn = get_connection()
+    if conn:
+        refresh_replica(conn, full=args.full)
+        conn.close()
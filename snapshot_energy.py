@@ -0,0 +1,143 @@
+import argparse
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytz
+
+from connect_local import get_connection
+from tables_energy import build_tables, build_views
+
+# ------------------------------
+# Snapshot della dashboard (Arrow IPC / Feather)
+# ------------------------------
+# Layout: SNAPSHOT_DIR/<versione>/<vista>.arrow + SNAPSHOT_DIR/CURRENT (versione attiva).
+# Si salvano le viste già pronte per il layout (tables_energy.build_views), non le tabelle grezze.
+# I file non sono compressi, così i worker li mappano in memoria senza copie e
+# condividono la stessa copia fisica nella page cache.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+CURRENT = "CURRENT"
+KEEP_VERSIONS = 3
+
+def conn_fetch_df(conn):
+    # fetch_df su una connessione psycopg2 (stessa firma di quello delle dashboard).
+    # Gli errori vengono propagati: uno snapshot con tabelle vuote non va pubblicato
+    def fetch_df(query):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                columns = [d[0] for d in cursor.description]
+                return pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+        except Exception:
+            conn.rollback()
+            raise
+    return fetch_df
+
+# ------------------------------
+# Scrittura
+# ------------------------------
+def write_snapshot(tables, snapshot_dir=None):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    version = datetime.now(pytz.UTC).strftime("%Y%m%dT%H%M%S%fZ")
+    tmp_dir = os.path.join(snapshot_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    for name, df in tables.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"snapshot_version": version.encode()})
+        feather.write_feather(table, os.path.join(tmp_dir, f"{name}.arrow"), compression="uncompressed")
+
+    # Prima la directory completa, poi il puntatore: i lettori non vedono mai snapshot parziali
+    os.rename(tmp_dir, os.path.join(snapshot_dir, version))
+    with open(os.path.join(snapshot_dir, f"{CURRENT}.tmp"), "w") as f:
+        f.write(version)
+    os.replace(os.path.join(snapshot_dir, f"{CURRENT}.tmp"), os.path.join(snapshot_dir, CURRENT))
+
+    # Le versioni vecchie possono essere rimosse: i file già mappati restano validi fino all'unmap
+    versions = sorted(d for d in os.listdir(snapshot_dir) if not d.startswith(".") and d != CURRENT and not d.endswith(".tmp"))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+
+    logging.info(f"Snapshot {version} scritto: {len(tables)} tabelle")
+    return version
+
+def build_snapshot(conn, snapshot_dir=None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    if not snapshot_dir:
+        logging.info("SNAPSHOT_DIR non impostata: snapshot non generato")
+        return None
+    os.makedirs(snapshot_dir, exist_ok=True)
+    try:
+        views = build_views(build_tables(conn_fetch_df(conn)))
+    except Exception as e:
+        # CURRENT resta sulla versione precedente
+        logging.error(f"Errore lettura dati snapshot, snapshot non pubblicato: {e}")
+        return None
+    conn.rollback()  # solo letture
+    return write_snapshot(views, snapshot_dir)
+
+# ------------------------------
+# Lettura (memory-map)
+# ------------------------------
+def current_version(snapshot_dir=None):
+    try:
+        with open(os.path.join(snapshot_dir or SNAPSHOT_DIR, CURRENT)) as f:
+            return f.read().strip() or None
+    except (FileNotFoundError, TypeError):
+        return None
+
+def load_snapshot(snapshot_dir, version):
+    import pyarrow as pa
+
+    tables = {}
+    version_dir = os.path.join(snapshot_dir, version)
+    for filename in sorted(os.listdir(version_dir)):
+        if filename.endswith(".arrow"):
+            # I buffer della tabella puntano direttamente alla mappatura del file
+            source = pa.memory_map(os.path.join(version_dir, filename), "r")
+            tables[filename[:-len(".arrow")]] = pa.ipc.open_file(source).read_all()
+    return tables
+
+class SnapshotWatcher:
+    # Tiene la versione attiva e la sostituisce quando CURRENT punta a una più recente
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+        self.version = None
+        self.tables = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        version = current_version(self.snapshot_dir)
+        if version is None or version == self.version:
+            return False
+        with self.lock:
+            if version == self.version:
+                return False
+            try:
+                self.tables = load_snapshot(self.snapshot_dir, version)
+            except Exception as e:
+                print("Errore caricamento snapshot:", e)
+                return False
+            self.version = version
+        return True
+
+    def records(self):
+        # Righe Python lette direttamente dai buffer mappati, senza passare da pandas
+        return {name: table.to_pylist() for name, table in self.tables.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generazione snapshot della dashboard")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="cartella degli snapshot (default: SNAPSHOT_DIR)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    conn = get_connection()
+    if conn:
+        build_snapshot(conn, args.dir)
+        conn.close()
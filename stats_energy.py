@@ -0,0 +1,265 @@
+import argparse
+import logging
+from datetime import datetime, time, timedelta
+
+import pandas as pd
+import pytz
+
+from connect_local import get_connection
+from dirty_ranges import ensure_dirty_ranges_table, load_dirty_ranges, snapshot_xmin, get_watermark, set_watermark
+from hourly_grid import ensure_hourly_tables
+
+# ------------------------------
+# KPI incrementali
+# ------------------------------
+# kpi_daily tiene gli accumulatori giornalieri per paese (somma/conteggio/picco
+# del carico, produzione totale e rinnovabile). Ad ogni aggiornamento vengono
+# riscritti solo i giorni segnati in dirty_ranges dopo l'ultimo watermark (tx_id);
+# le finestre mobili si calcolano poi su al massimo due anni di righe giornaliere.
+# Le sorgenti sono le tabelle orarie (MWh reali qualunque sia la risoluzione nativa):
+# load_count conta le ore e load_peak è il massimo orario (MWh in un'ora = MW medi).
+RENEWABLE_SOURCES = [
+    "Biomass",
+    "Geothermal",
+    "Hydro Run-of-river and poundage",
+    "Hydro Water Reservoir",
+    "Marine",
+    "Other renewable",
+    "Solar",
+    "Wind Offshore",
+    "Wind Onshore",
+]
+
+WINDOWS = [7, 30, 365]
+HOURS_PER_DAY = 24  # giorni UTC: sempre 24 ore nella griglia oraria
+CONSUMER = "stats_energy"
+
+def ensure_kpi_tables(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS kpi_daily (
+                country_code TEXT NOT NULL,
+                date DATE NOT NULL,
+                load_sum DOUBLE PRECISION,
+                load_count INTEGER,
+                load_peak DOUBLE PRECISION,
+                gen_sum DOUBLE PRECISION,
+                gen_renewable_sum DOUBLE PRECISION,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (country_code, date)
+            );
+            CREATE TABLE IF NOT EXISTS kpi_rolling (
+                country_code TEXT PRIMARY KEY,
+                as_of DATE NOT NULL,
+                avg_7d DOUBLE PRECISION,
+                avg_30d DOUBLE PRECISION,
+                avg_365d DOUBLE PRECISION,
+                peak_load_mw DOUBLE PRECISION,
+                load_factor DOUBLE PRECISION,
+                renewable_share DOUBLE PRECISION,
+                yoy_delta_pct DOUBLE PRECISION,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+    conn.commit()
+
+# ------------------------------
+# Accumulatori giornalieri
+# ------------------------------
+DAILY_QUERIES = {
+    "consumption": """
+        INSERT INTO kpi_daily(country_code, date, load_sum, load_count, load_peak)
+        SELECT country_code, (timestamp AT TIME ZONE 'UTC')::date,
+               SUM(consumption_mwh), COUNT(consumption_mwh), MAX(consumption_mwh)
+        FROM consumption_hourly
+        WHERE country_code = %(country)s AND timestamp >= %(start)s AND timestamp < %(end)s
+        GROUP BY 1, 2
+        ON CONFLICT (country_code, date) DO UPDATE
+        SET load_sum = EXCLUDED.load_sum,
+            load_count = EXCLUDED.load_count,
+            load_peak = EXCLUDED.load_peak,
+            updated_at = now();
+    """,
+    "production": """
+        INSERT INTO kpi_daily(country_code, date, gen_sum, gen_renewable_sum)
+        SELECT p.country_code, (p.timestamp AT TIME ZONE 'UTC')::date,
+               SUM(p.production_mwh),
+               COALESCE(SUM(p.production_mwh) FILTER (WHERE e.source_name = ANY(%(renewables)s)), 0)
+        FROM production_hourly p
+        JOIN energy_sources e ON p.source_id = e.source_id
+        WHERE p.country_code = %(country)s AND p.timestamp >= %(start)s AND p.timestamp < %(end)s
+        GROUP BY 1, 2
+        ON CONFLICT (country_code, date) DO UPDATE
+        SET gen_sum = EXCLUDED.gen_sum,
+            gen_renewable_sum = EXCLUDED.gen_renewable_sum,
+            updated_at = now();
+    """,
+}
+
+def merge_day_ranges(ranges):
+    # Unisce gli intervalli [range_start, range_end] sovrapposti o contigui
+    merged = []
+    for range_start, range_end in sorted(ranges):
+        if merged and range_start <= merged[-1][1] + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+def update_daily(cursor, dataset, country, range_start, range_end):
+    cursor.execute(DAILY_QUERIES[dataset], {
+        "country": country,
+        "start": datetime.combine(range_start, time.min, tzinfo=pytz.UTC),
+        "end": datetime.combine(range_end + timedelta(days=1), time.min, tzinfo=pytz.UTC),
+        "renewables": RENEWABLE_SOURCES,
+    })
+
+# ------------------------------
+# KPI mobili
+# ------------------------------
+def compute_rolling(daily):
+    # daily: righe giornaliere di un paese (al massimo ~2 anni)
+    daily = daily.set_index(pd.to_datetime(daily["date"])).sort_index()
+    # Solo giorni completi per le medie: il giorno in corso (parziale) le abbasserebbe
+    complete = daily[daily["load_count"] >= HOURS_PER_DAY]
+    if complete.empty:
+        return None
+    as_of = complete.index.max()
+
+    def window(days, shift_days=0, frame=daily):
+        end = as_of - pd.Timedelta(days=shift_days)
+        return frame[(frame.index > end - pd.Timedelta(days=days)) & (frame.index <= end)]
+
+    kpi = {"as_of": as_of.date()}
+    for days in WINDOWS:
+        kpi[f"avg_{days}d"] = window(days, frame=complete)["load_sum"].mean()
+
+    year = window(365)
+    kpi["peak_load_mw"] = year["load_peak"].max()
+    avg_load = year["load_sum"].sum() / year["load_count"].sum() if year["load_count"].sum() else None
+    kpi["load_factor"] = avg_load / kpi["peak_load_mw"] if avg_load and kpi["peak_load_mw"] else None
+
+    month = window(30)
+    gen = month["gen_sum"].sum()
+    kpi["renewable_share"] = month["gen_renewable_sum"].sum() / gen * 100 if gen else None
+
+    # Ultimi 30 giorni contro gli stessi 30 giorni dell'anno precedente
+    last_year = window(30, shift_days=365, frame=complete)["load_sum"]
+    this_year = window(30, frame=complete)["load_sum"]
+    if last_year.count() and this_year.count():
+        kpi["yoy_delta_pct"] = (this_year.mean() - last_year.mean()) / last_year.mean() * 100
+    else:
+        kpi["yoy_delta_pct"] = None
+
+    return {k: (None if isinstance(v, float) and pd.isna(v) else v) for k, v in kpi.items()}
+
+def update_rolling(cursor, country):
+    cursor.execute("""
+        SELECT date, load_sum, load_count, load_peak, gen_sum, gen_renewable_sum
+        FROM kpi_daily
+        WHERE country_code = %s
+          AND date > (SELECT MAX(date) FROM kpi_daily WHERE country_code = %s) - 731
+        ORDER BY date;
+    """, (country, country))
+    daily = pd.DataFrame(cursor.fetchall(), columns=[
+        "date", "load_sum", "load_count", "load_peak", "gen_sum", "gen_renewable_sum"
+    ])
+    for col in daily.columns[1:]:
+        daily[col] = pd.to_numeric(daily[col])
+    kpi = compute_rolling(daily) if not daily.empty else None
+    if kpi is None:
+        return None
+
+    cursor.execute("""
+        INSERT INTO kpi_rolling(country_code, as_of, avg_7d, avg_30d, avg_365d,
+                                peak_load_mw, load_factor, renewable_share, yoy_delta_pct, updated_at)
+        VALUES (%(country)s, %(as_of)s, %(avg_7d)s, %(avg_30d)s, %(avg_365d)s,
+                %(peak_load_mw)s, %(load_factor)s, %(renewable_share)s, %(yoy_delta_pct)s, now())
+        ON CONFLICT (country_code) DO UPDATE
+        SET as_of = EXCLUDED.as_of,
+            avg_7d = EXCLUDED.avg_7d,
+            avg_30d = EXCLUDED.avg_30d,
+            avg_365d = EXCLUDED.avg_365d,
+            peak_load_mw = EXCLUDED.peak_load_mw,
+            load_factor = EXCLUDED.load_factor,
+            renewable_share = EXCLUDED.renewable_share,
+            yoy_delta_pct = EXCLUDED.yoy_delta_pct,
+            updated_at = now();
+    """, {"country": country, **{k: float(v) if isinstance(v, float) else v for k, v in kpi.items()}})
+    return kpi
+
+# ------------------------------
+# Aggiornamento
+# ------------------------------
+def update_kpis(conn):
+    ensure_dirty_ranges_table(conn)
+    ensure_hourly_tables(conn)
+    ensure_kpi_tables(conn)
+    with conn.cursor() as cursor:
+        watermark = get_watermark(cursor, CONSUMER)
+    if watermark is None:
+        # Primo avvio: gli intervalli più vecchi possono essere già stati cancellati
+        rebuild_kpis(conn)
+        return {}
+    ranges, upto_tx = load_dirty_ranges(conn, after_tx=watermark, datasets=list(DAILY_QUERIES))
+    if ranges.empty:
+        with conn.cursor() as cursor:
+            set_watermark(cursor, CONSUMER, upto_tx)
+        conn.commit()
+        logging.info("KPI: nessun intervallo da aggiornare")
+        return {}
+
+    updated = {}
+    try:
+        with conn.cursor() as cursor:
+            for (dataset, country), group in ranges.groupby(["dataset", "country_code"]):
+                for range_start, range_end in merge_day_ranges(zip(group["range_start"], group["range_end"])):
+                    update_daily(cursor, dataset, country, range_start, range_end)
+            for country in ranges["country_code"].unique():
+                updated[country] = update_rolling(cursor, country)
+            set_watermark(cursor, CONSUMER, upto_tx)
+        conn.commit()
+    except Exception as e:
+        logging.error(f"Errore aggiornamento KPI: {e}")
+        conn.rollback()
+        return {}
+
+    logging.info(f"KPI aggiornati: {len(ranges)} intervalli, paesi {list(updated)}")
+    return updated
+
+def rebuild_kpis(conn):
+    # Ricostruzione completa degli accumulatori (primo avvio o dati caricati prima di dirty_ranges)
+    ensure_dirty_ranges_table(conn)
+    ensure_hourly_tables(conn)
+    ensure_kpi_tables(conn)
+    with conn.cursor() as cursor:
+        # Le transazioni ancora aperte (tx_id >= xmin) verranno riprese da update_kpis
+        upto_tx = snapshot_xmin(cursor)
+        for dataset, table in [("consumption", "consumption_hourly"), ("production", "production_hourly")]:
+            cursor.execute(f"""
+                SELECT country_code, MIN(timestamp AT TIME ZONE 'UTC')::date, MAX(timestamp AT TIME ZONE 'UTC')::date
+                FROM {table}
+                GROUP BY country_code;
+            """)
+            for country, range_start, range_end in cursor.fetchall():
+                update_daily(cursor, dataset, country, range_start, range_end)
+        cursor.execute("SELECT DISTINCT country_code FROM kpi_daily;")
+        for (country,) in cursor.fetchall():
+            update_rolling(cursor, country)
+        set_watermark(cursor, CONSUMER, upto_tx)
+    conn.commit()
+    logging.info("KPI ricostruiti da zero")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggiornamento KPI incrementali")
+    parser.add_argument("--rebuild", action="store_true", help="ricostruisce gli accumulatori da tutto lo storico")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    conn = get_connection()
+    if conn:
+        if args.rebuild:
+            rebuild_kpis(conn)
+        else:
+            update_kpis(conn)
+        conn.close()
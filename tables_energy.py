@@ -0,0 +1,318 @@
+# tables_energy.py
+# Pipeline pandas della dashboard: dalle query al DB alle tabelle pronte per layout e grafici.
+# Usata sia da dashboard_energy_full.py sia da snapshot_energy.py.
+import json
+
+import pandas as pd
+
+# ------------------------------
+# Caricamento dati
+# ------------------------------
+def hourly_grid_built(fetch_df):
+    # Marker scritto da hourly_grid.rebuild_hourly: prima le tabelle *_hourly sono incomplete
+    try:
+        return not fetch_df("SELECT built_at FROM hourly_grid_state;").empty
+    except Exception:
+        return False
+
+def load_energy(fetch_df, query):
+    # Griglia oraria (MWh reali); tabella grezza finché la griglia non è stata costruita
+    suffix = "_hourly" if hourly_grid_built(fetch_df) else ""
+    return fetch_df(query.format(suffix=suffix))
+
+def load_raw(fetch_df):
+    consumption = load_energy(fetch_df, "SELECT country_code, timestamp, consumption_mwh FROM consumption{suffix};")
+    production = load_energy(fetch_df, """
+    SELECT p.country_code, e.source_name, p.timestamp, p.production_mwh
+    FROM production{suffix} p
+    JOIN energy_sources e ON p.source_id = e.source_id;
+    """)
+    flows = load_energy(fetch_df, "SELECT from_country, to_country, timestamp, flow_mwh FROM crossborder_flows{suffix};")
+    # KPI mobili mantenuti in modo incrementale da stats_energy.py: opzionali
+    # (tabella assente finché update_kpis non è mai stato eseguito). Il try serve allo
+    # snapshot, il cui fetch_df propaga gli errori; quello delle dashboard restituisce già
+    # un DataFrame vuoto
+    try:
+        kpi_rolling = fetch_df("SELECT * FROM kpi_rolling;")
+    except Exception as e:
+        print("KPI mobili non disponibili:", e)
+        kpi_rolling = pd.DataFrame()
+    return consumption, production, flows, kpi_rolling
+
+def with_country(df, country):
+    df = df.copy()
+    df.insert(0, 'country', country)
+    return df
+
+# ------------------------------
+# Tabelle
+# ------------------------------
+def build_tables(fetch_df):
+    consumption, production, flows, kpi_rolling = load_raw(fetch_df)
+
+    # Preprocessing
+    for df in [consumption, production, flows]:
+        if not df.empty:
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+
+    # Aggiungi colonna 'date' per evitare errori
+    if not consumption.empty:
+        consumption['date'] = consumption['timestamp'].dt.date
+    if not production.empty:
+        production['date'] = production['timestamp'].dt.date
+    if not flows.empty:
+        flows['date'] = flows['timestamp'].dt.date
+
+    # ------------------------------
+    # KPI per paese
+    # ------------------------------
+    cons_daily, cons_monthly, cons_yearly = [], [], []
+    prod_daily, prod_monthly, prod_yearly = [], [], []
+    countries = consumption['country_code'].unique() if not consumption.empty else []
+
+    for country in countries:
+        cons_country = consumption[consumption['country_code'] == country].copy()
+        net_country = flows[(flows['from_country'] == country) | (flows['to_country'] == country)].copy() if not flows.empty else pd.DataFrame()
+
+        # Rimuovo timezone
+        cons_country['timestamp'] = cons_country['timestamp'].dt.tz_convert(None)
+        if not net_country.empty:
+            net_country['timestamp'] = net_country['timestamp'].dt.tz_convert(None)
+
+        # Periodi
+        cons_country['month_start'] = cons_country['timestamp'].dt.to_period('M').dt.start_time
+        cons_country['year'] = cons_country['timestamp'].dt.year
+
+        # Totali giornalieri, mensili, annuali
+        daily_totals = cons_country.groupby('date')['consumption_mwh'].sum().reset_index(name='total')
+        daily_totals['avg'] = daily_totals['total'].mean()
+        monthly_totals = cons_country.groupby('month_start')['consumption_mwh'].sum().reset_index(name='total')
+        monthly_totals['avg'] = monthly_totals['total'].mean()
+        yearly_totals = cons_country.groupby('year')['consumption_mwh'].sum().reset_index(name='total')
+        yearly_totals['avg'] = daily_totals['total'].mean()  # media giornaliera complessiva
+
+        # Import ed Export annuali
+        if not net_country.empty:
+            net_country['year'] = net_country['timestamp'].dt.year
+
+            yearly_import = (
+                net_country[net_country['to_country'] == country]
+                .groupby('year')['flow_mwh']
+                .sum()
+                .reset_index(name='Import')
+            )
+
+            yearly_export = (
+                net_country[net_country['from_country'] == country]
+                .groupby('year')['flow_mwh']
+                .sum()
+                .reset_index(name='Export')
+            )
+
+            # Merge con yearly_totals
+            yearly_totals = yearly_totals.merge(yearly_import, on='year', how='left') \
+                                         .merge(yearly_export, on='year', how='left')
+            yearly_totals[['Import','Export']] = yearly_totals[['Import','Export']].fillna(0)
+            yearly_totals['Net Import/Export'] = yearly_totals['Import'] - yearly_totals['Export']
+        else:
+            yearly_totals['Import'] = 0.0
+            yearly_totals['Export'] = 0.0
+            yearly_totals['Net Import/Export'] = 0.0
+
+        cons_daily.append(with_country(daily_totals, country))
+        cons_monthly.append(with_country(monthly_totals, country))
+        cons_yearly.append(with_country(yearly_totals, country))
+
+        # Produzione per fonte
+        prod_country = production[production['country_code'] == country].copy() if not production.empty else pd.DataFrame()
+        if not prod_country.empty:
+            prod_country['month_start'] = prod_country['timestamp'].dt.tz_convert(None).dt.to_period('M').dt.start_time
+            prod_country['year'] = prod_country['timestamp'].dt.year
+
+            prod_daily.append(with_country(prod_country.groupby(['date','source_name'])['production_mwh'].sum().reset_index(), country))
+            prod_monthly.append(with_country(prod_country.groupby(['month_start','source_name'])['production_mwh'].sum().reset_index(), country))
+            prod_yearly.append(with_country(prod_country.groupby(['year','source_name'])['production_mwh'].sum().reset_index(), country))
+
+    def concat(frames):
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    tables = {
+        'consumption_daily': concat(cons_daily),
+        'consumption_monthly': concat(cons_monthly),
+        'consumption_yearly': concat(cons_yearly),
+        'production_daily': concat(prod_daily),
+        'production_monthly': concat(prod_monthly),
+        'production_yearly': concat(prod_yearly),
+        'kpi_rolling': kpi_rolling,
+    }
+
+    # ------------------------------
+    # Serie per i grafici
+    # ------------------------------
+    if not consumption.empty and not production.empty:
+        daily_cons = consumption.groupby(['country_code','date']).agg(total_mwh_cons=('consumption_mwh','sum')).reset_index()
+        daily_prod = production.groupby(['country_code','date']).agg(total_mwh_prod=('production_mwh','sum')).reset_index()
+        time_df = pd.merge(daily_cons, daily_prod, on=['country_code','date'], how='outer')
+        for col in ['total_mwh_cons','total_mwh_prod']:
+            if col not in time_df.columns:
+                time_df[col] = 0.0
+            else:
+                time_df[col] = time_df[col].astype(float)
+        tables['time_series'] = time_df
+    else:
+        tables['time_series'] = pd.DataFrame()
+
+    # Production mix
+    tables['production_mix'] = production[['country_code','source_name','timestamp','production_mwh']] \
+        if not production.empty else pd.DataFrame()
+
+    # Net balance
+    if not flows.empty:
+        total_export = flows.groupby('from_country')['flow_mwh'].sum().reset_index(name='export')
+        total_import = flows.groupby('to_country')['flow_mwh'].sum().reset_index(name='import')
+        net_balance = pd.merge(total_export, total_import, left_on='from_country', right_on='to_country', how='outer') \
+                        .fillna({'export': 0, 'import': 0})
+        net_balance['country'] = net_balance['from_country'].combine_first(net_balance['to_country'])
+        net_balance['export'] = -net_balance['export']
+        net_balance['net_balance'] = net_balance['import'] + net_balance['export']
+        tables['net_balance'] = net_balance[['country','export','import','net_balance']]
+    else:
+        tables['net_balance'] = pd.DataFrame()
+
+    # Heatmap consumo orario
+    if not consumption.empty:
+        consumption['hour'] = consumption['timestamp'].dt.hour
+        consumption['day'] = consumption['timestamp'].dt.date
+        tables['heatmap'] = consumption.groupby(['country_code','day','hour']).agg(total_mwh=('consumption_mwh','sum')).reset_index()
+    else:
+        tables['heatmap'] = pd.DataFrame()
+
+    # ------------------------------
+    # Tabella giornaliera con net balance
+    # ------------------------------
+    if not consumption.empty and not production.empty:
+        daily_table = tables['time_series'].copy()
+    else:
+        daily_table = pd.DataFrame()
+
+    if not flows.empty and not daily_table.empty:
+        daily_export = flows.groupby(['from_country','date']).agg(export=('flow_mwh','sum')).reset_index()
+        daily_import = flows.groupby(['to_country','date']).agg(import_=('flow_mwh','sum')).reset_index()
+        net_daily = pd.merge(daily_export, daily_import, left_on=['from_country','date'], right_on=['to_country','date'], how='outer') \
+                      .fillna({'export': 0, 'import_': 0})
+        net_daily['country'] = net_daily['from_country'].combine_first(net_daily['to_country'])
+        net_daily['export'] = -net_daily['export']
+        net_daily['net_balance'] = net_daily['import_'] + net_daily['export']
+        daily_table = pd.merge(
+            daily_table,
+            net_daily[['country','date','export','import_','net_balance']],
+            left_on=['country_code','date'],
+            right_on=['country','date'], how='left'
+        ).drop(columns='country')
+    else:
+        for col in ['export','import_','net_balance']:
+            daily_table[col] = 0
+
+    tables['daily_table'] = daily_table
+    tables['flows'] = flows
+    return tables
+
+# ------------------------------
+# Viste per il layout
+# ------------------------------
+# Tutto ciò che il layout usa, già diviso per paese e nel formato dei componenti
+# (righe delle DataTable, payload JSON dei dcc.Store). Lo snapshot salva queste viste
+# al posto delle tabelle grezze: i worker leggono le righe dai buffer Arrow senza
+# rifare pivot e aggregazioni.
+COUNTRY_VIEWS = ['consumption_daily', 'consumption_monthly', 'consumption_yearly',
+                 'production_daily', 'production_monthly', 'production_yearly', 'net_yearly']
+
+def country_rows(df, country):
+    if df.empty:
+        return df
+    return df[df['country'] == country].drop(columns='country').reset_index(drop=True)
+
+def country_view(name, country):
+    return f"{name}__{country}"
+
+def num_list(values):
+    return [None if pd.isna(v) else round(float(v), 3) for v in values]
+
+def date_list(values, fmt='%Y-%m-%d'):
+    return pd.to_datetime(pd.Series(values)).dt.strftime(fmt).tolist()
+
+def visual_stores(tables):
+    time_data = {}
+    time_df = tables['time_series']
+    if not time_df.empty:
+        for country, df in time_df.sort_values('date').groupby('country_code'):
+            time_data[country] = {
+                'x': date_list(df['date']),
+                'cons': num_list(df['total_mwh_cons']),
+                'prod': num_list(df['total_mwh_prod'])
+            }
+
+    # Mix in formato colonnare: un array di timestamp per paese e un array di valori per fonte
+    mix_data = {}
+    production = tables['production_mix']
+    if not production.empty:
+        for country, df in production.groupby('country_code'):
+            wide = df.pivot_table(index='timestamp', columns='source_name', values='production_mwh',
+                                  aggfunc='sum').fillna(0).sort_index()
+            mix_data[country] = {
+                'x': date_list(wide.index, '%Y-%m-%d %H:%M'),
+                'series': {source: num_list(wide[source]) for source in wide.columns}
+            }
+
+    net_data = {}
+    net_balance = tables['net_balance']
+    if not net_balance.empty:
+        net_balance = net_balance.sort_values('country')
+        net_data = {'country': net_balance['country'].tolist()}
+        for col in ['export', 'import', 'net_balance']:
+            net_data[col] = num_list(net_balance[col])
+
+    heat_data = {}
+    heatmap = tables['heatmap']
+    if not heatmap.empty:
+        for country, df in heatmap.groupby('country_code'):
+            grid = df.pivot_table(index='day', columns='hour', values='total_mwh', aggfunc='sum') \
+                     .reindex(columns=range(24)).sort_index()
+            heat_data[country] = {
+                'days': date_list(grid.index),
+                'hours': list(range(24)),
+                'z': [num_list(row) for row in grid.to_numpy()]
+            }
+
+    sources = sorted(production['source_name'].unique()) if not production.empty else []
+    return {'time': time_data, 'mix': mix_data, 'net': net_data, 'heat': heat_data, 'sources': sources}
+
+def build_views(tables):
+    views = {}
+    consumption_daily = tables['consumption_daily']
+    countries = sorted(consumption_daily['country'].unique()) if not consumption_daily.empty else []
+    views['countries'] = pd.DataFrame({'country': countries})
+    for country in countries:
+        for name in COUNTRY_VIEWS[:-1]:
+            views[country_view(name, country)] = country_rows(tables[name], country)
+        yearly = views[country_view('consumption_yearly', country)]
+        views[country_view('net_yearly', country)] = yearly[['year','Import','Export','Net Import/Export']]
+
+    views['kpi_rolling'] = tables['kpi_rolling']
+    views['daily_table'] = tables['daily_table']
+    views['flows'] = tables['flows']
+
+    # Un payload JSON per store: il worker fa solo json.loads
+    stores = visual_stores(tables)
+    views['visual_stores'] = pd.DataFrame({
+        'store': list(stores),
+        'payload': [json.dumps(data) for data in stores.values()]
+    })
+    return views
+
+def view_records(views):
+    # Stesso formato di SnapshotWatcher.records(): righe pronte per le DataTable
+    return {name: df.to_dict('records') for name, df in views.items()}
+
+def view_stores(records):
+    return {row['store']: json.loads(row['payload']) for row in records['visual_stores']}